@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+In-process microbenchmarks for the serving hot paths:
+
+  load_index        artifacts -> IndexBundle (encoder reused; the first,
+                    cold load including the model is reported separately)
+  search            one query per call (encode + FAISS + frame)
+  search_many       --batch queries per call
+  rerank            rerank_candidates over a 4*topk pool (gate + duration)
+
+Targets are the real index (--indexdir, real encoder) and/or synthetic
+catalogs (--synthetic 1000,100000,1000000). Synthetic runs use a hash-seeded
+random encoder, so they measure everything except the transformer forward
+pass; their artifacts are cached under --workdir. Every target runs in a
+fresh process so peak RSS is its own.
+
+Writes JSON (p50/p95/p99/mean ms, throughput and resident-memory growth per
+benchmark, plus one "<target>/process" entry with the target's peak RSS)
+and, with --baseline, exits 1 if a benchmark got slower than --threshold
+(or a target's peak RSS grew more than --rss-threshold) relative to the
+baseline.
+
+Usage:
+  python bench/microbench.py --indexdir index --synthetic 1000,100000 --out bench_results.json
+  python bench/microbench.py --indexdir index --save-baseline bench/baseline.json
+  python bench/microbench.py --indexdir index --baseline bench/baseline.json --threshold 0.15
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# indexer.py imports its siblings without the src. prefix; use the same module set
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+import faiss  # noqa: E402
+from filters import AttributeIndex  # noqa: E402
+from indexer import ATTRIBUTES_FILE, KEYWORDS_FILE, PARAMS_FILE, SAFE_COLS, build_faiss_index, \
+    default_index_params, write_manifest  # noqa: E402
+from rerank import build_keyword_postings, precompute_rerank_arrays, rerank_candidates  # noqa: E402
+from retriever import configure_query_cache, load_index, search, search_many  # noqa: E402
+
+SYNTHETIC_MODEL = "synthetic-hash"
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+# ----------------------------
+# Synthetic catalogs
+# ----------------------------
+class HashEncoder:
+    """Deterministic random unit vectors per text; stands in for the transformer."""
+    def __init__(self, dim: int):
+        self.dim = int(dim)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = False,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(str(t).encode(), digest_size=8).digest(), "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out[0] if single else out
+
+WORDS = ("python sql excel tableau statistics developer engineer analyst data qa testing automation "
+         "communication stakeholder manager sales marketing java javascript leadership customer service "
+         "numerical verbal reasoning personality cognitive simulation coding cloud security finance "
+         "operations retail graduate entry supervisor professional contact center agile").split()
+
+def synthetic_meta(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS)
+
+    def phrases(k):
+        picks = words[rng.integers(0, len(words), size=(n, k))]
+        return [" ".join(row) for row in picks]
+
+    return pd.DataFrame({
+        "assessment_id": [f"syn-{i}" for i in range(n)],
+        "title": [t.title() for t in phrases(3)],
+        "url": [f"https://example.invalid/assessment/{i}" for i in range(n)],
+        "description": phrases(30),
+        "category": rng.choice(["Technical", "Behavioral", "Cognitive", "Sales"], n),
+        "test_type": rng.choice(["K", "P", "A", "S", "B", "C", "K, S"], n),
+        "level": rng.choice(["Entry-Level", "Graduate", "Mid-Professional", "Manager", "Director"], n),
+        "duration_min": rng.integers(5, 91, n).astype(float),
+        "language": rng.choice(["English (USA)", "English International", "German", "French"], n),
+        "tags": phrases(4),
+    })[SAFE_COLS]
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0, chunk: int = 100_000) -> np.ndarray:
+    """Clustered unit vectors (256 topics + noise), generated in chunks."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    X = np.empty((n, dim), dtype=np.float32)
+    for s in range(0, n, chunk):
+        m = min(chunk, n - s)
+        X[s:s + m] = centers[rng.integers(0, len(centers), m)] + 0.7 * rng.standard_normal((m, dim))
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X
+
+def ensure_synthetic(workdir: str, n: int, dim: int, index_type: str) -> Path:
+    """Index dir for a synthetic catalog of n rows (built once, then reused)."""
+    out = Path(workdir) / f"synthetic-{n}-{dim}-{index_type}"
+    if (out / "manifest.json").exists():
+        return out
+    out.mkdir(parents=True, exist_ok=True)
+    print(f"[INFO] Building synthetic catalog n={n} dim={dim} ({index_type}) in {out} ...")
+    meta = synthetic_meta(n)
+    X = synthetic_vectors(n, dim)
+    params = default_index_params(index_type, n, dim)
+    faiss.write_index(build_faiss_index(X, params), str(out / "faiss.index"))
+    (out / PARAMS_FILE).write_text(json.dumps(params, indent=2))
+    np.save(str(out / "vectors.npy"), X)
+    meta.to_parquet(str(out / "meta.parquet"), index=False)
+    postings = build_keyword_postings(precompute_rerank_arrays(meta)["text_blob"])
+    np.savez(str(out / KEYWORDS_FILE), n=np.int64(n), terms=np.array(list(postings)),
+             bits=np.stack(list(postings.values())))
+    AttributeIndex.build(meta).save(str(out / ATTRIBUTES_FILE))
+    write_manifest(out, SYNTHETIC_MODEL, params, n, dim, backend="synthetic")
+    return out
+
+# ----------------------------
+# Timing
+# ----------------------------
+def peak_rss_mb() -> float:
+    """High-water mark of the whole process (so: once per target, not per benchmark)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+def current_rss_mb():
+    """Resident memory right now (Linux /proc), or None where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def measure(fn):
+    """(fn(), resident MB it added) - what this benchmark itself kept in memory."""
+    before = current_rss_mb()
+    out = fn()
+    after = current_rss_mb()
+    return out, (after - before if before is not None and after is not None else None)
+
+def summarize(samples, items_per_call: int = 1) -> dict:
+    s = np.asarray(samples, dtype=np.float64)
+    ms = s * 1000.0
+    return {
+        "n": int(len(s)),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "throughput_per_s": float(items_per_call * len(s) / s.sum()) if s.sum() > 0 else 0.0,
+    }
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+def load_queries(path: str, limit: int):
+    df = pd.read_csv(path)
+    col = next((c for c in df.columns if str(c).strip().lower() in {"query", "queries", "jd", "text"}),
+               df.columns[0])
+    qs = df[col].dropna().astype(str).drop_duplicates().tolist()
+    return qs[:limit] if limit else qs
+
+def run_target(name: str, indexdir: str, synthetic_dim: int, cfg: dict) -> dict:
+    """All benchmarks for one index dir; runs in its own process."""
+    queries = load_queries(cfg["queries"], cfg["limit"])
+    queries = (queries * (cfg["iterations"] // max(1, len(queries)) + 1))[:cfg["iterations"]]
+    configure_query_cache(maxsize=0)   # every search pays for its encode
+    model = HashEncoder(synthetic_dim) if synthetic_dim else None
+    kw = {"mmap": cfg["mmap"]}
+    results = {}
+
+    (bundle, cold), rss = measure(lambda: timed(load_index, indexdir, model=model, **kw))
+    results["load_index_cold"] = {**summarize([cold]), "rows": len(bundle.meta), "rss_delta_mb": rss}
+    loads, rss = measure(lambda: [timed(load_index, indexdir, model=bundle.model, **kw)[1]
+                                  for _ in range(cfg["load_repeat"])])
+    results["load_index"] = {**summarize(loads), "rss_delta_mb": rss}
+
+    topk = cfg["topk"]
+    for q in queries[:cfg["warmup"]]:
+        search(bundle, q, topk=topk)
+
+    samples, rss = measure(lambda: [timed(search, bundle, q, topk=topk)[1] for q in queries])
+    results["search"] = {**summarize(samples), "rss_delta_mb": rss}
+
+    bs = cfg["batch"]
+    batches = [queries[s:s + bs] for s in range(0, len(queries) - bs + 1, bs)] or [queries]
+    samples, rss = measure(lambda: [timed(search_many, bundle, b, topk=topk)[1] for b in batches])
+    results["search_many"] = {**summarize(samples, items_per_call=len(batches[0])), "rss_delta_mb": rss}
+
+    pools = [(q, search(bundle, q, topk=topk)) for q in queries]
+    samples, rss = measure(lambda: [
+        timed(rerank_candidates, bundle.rerank_arrays, q, pool, cfg["rerank_topk"],
+              postings=bundle.keyword_postings)[1]
+        for q, pool in pools
+    ])
+    results["rerank"] = {**summarize(samples), "rss_delta_mb": rss}
+
+    fmt = lambda v: f"{v:+7.1f}MB" if v is not None else "    n/a"  # noqa: E731
+    for bench, r in results.items():
+        print(f"[BENCH] {name:<22} {bench:<16} p50={r['p50_ms']:9.3f}ms  p95={r['p95_ms']:9.3f}ms  "
+              f"p99={r['p99_ms']:9.3f}ms  thr={r['throughput_per_s']:9.1f}/s  rss{fmt(r['rss_delta_mb'])}")
+    results["process"] = {"peak_rss_mb": peak_rss_mb()}
+    print(f"[BENCH] {name:<22} {'process':<16} peak_rss={results['process']['peak_rss_mb']:.0f}MB")
+    return {f"{name}/{bench}": r for bench, r in results.items()}
+
+# ----------------------------
+# Baseline comparison
+# ----------------------------
+def compare(results: dict, baseline: dict, metric: str, threshold: float,
+            rss_threshold: float, min_delta_ms: float):
+    """Regression lines for benchmarks present in both runs."""
+    regressions = []
+    for key, cur in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None or key.endswith("/load_index_cold"):
+            continue   # cold load is one sample dominated by disk/model cache state
+        if key.endswith("/process"):
+            b, c = base.get("peak_rss_mb"), cur["peak_rss_mb"]
+            if rss_threshold and b is not None and c > b * (1.0 + rss_threshold):
+                regressions.append(f"{key}: peak RSS {b:.0f}MB -> {c:.0f}MB")
+            continue
+        if metric not in base:
+            continue
+        b, c = base[metric], cur[metric]
+        if c > b * (1.0 + threshold) and c - b > min_delta_ms:
+            growth = f"+{(c / b - 1.0) * 100:.1f}%" if b > 0 else "from 0"
+            regressions.append(f"{key}: {metric} {b:.3f}ms -> {c:.3f}ms ({growth})")
+    return regressions
+
+def main(args):
+    cfg = {
+        "queries": args.queries, "limit": args.limit, "iterations": args.iterations, "warmup": args.warmup,
+        "topk": args.topk, "rerank_topk": args.rerank_topk, "batch": args.batch,
+        "load_repeat": args.load_repeat, "mmap": args.mmap,
+    }
+    targets = []
+    if args.indexdir:
+        targets.append(("real", args.indexdir, 0))
+    for n in (int(x) for x in args.synthetic.split(",") if x.strip()):
+        targets.append((f"synthetic-{n}", str(ensure_synthetic(args.workdir, n, args.dim, args.index_type)),
+                        args.dim))
+
+    results = {}
+    for name, indexdir, dim in targets:
+        # fresh process per target: independent peak RSS, no warm caches carried over
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+            results.update(ex.submit(run_target, name, indexdir, dim, cfg).result())
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "faiss": getattr(faiss, "__version__", "?"),
+            "numpy": np.__version__,
+            "config": {**cfg, "synthetic": args.synthetic, "dim": args.dim, "index_type": args.index_type},
+        },
+        "results": results,
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"[DONE] Wrote {args.out}")
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2))
+        print(f"[DONE] Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.metric, args.threshold,
+                              args.rss_threshold, args.min_delta_ms)
+        for line in regressions:
+            print(f"[REGRESSION] {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"[OK] No regressions vs {args.baseline} ({args.metric}, threshold {args.threshold:.0%})")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--indexdir", default="index", help="Real index to benchmark ('' to skip)")
+    ap.add_argument("--synthetic", default="", help="Comma list of synthetic catalog sizes, e.g. 1000,100000,1000000")
+    ap.add_argument("--dim", type=int, default=384, help="Synthetic embedding dim")
+    ap.add_argument("--index-type", default="flat", help="Synthetic index type (see indexer.py --index-type)")
+    ap.add_argument("--workdir", default="bench/.cache", help="Where synthetic index dirs are kept")
+    ap.add_argument("--queries", default="Data/train_queries.csv")
+    ap.add_argument("--limit", type=int, default=0, help="Use at most N distinct queries")
+    ap.add_argument("--iterations", type=int, default=200, help="Timed calls per benchmark")
+    ap.add_argument("--warmup", type=int, default=10)
+    ap.add_argument("--topk", type=int, default=40, help="Search depth (same overfetch as /recommend)")
+    ap.add_argument("--rerank-topk", type=int, default=10)
+    ap.add_argument("--batch", type=int, default=32, help="Queries per search_many call")
+    ap.add_argument("--load-repeat", type=int, default=3)
+    ap.add_argument("--mmap", action="store_true", help="Load indexes with mmap=True")
+    ap.add_argument("--out", default="", help="JSON report path")
+    ap.add_argument("--save-baseline", default="", help="Also write this run as the baseline")
+    ap.add_argument("--baseline", default="", help="Compare against this baseline; exit 1 on regression")
+    ap.add_argument("--metric", default="p95_ms", choices=LATENCY_KEYS)
+    ap.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown")
+    ap.add_argument("--rss-threshold", type=float, default=0.25, help="Allowed relative growth of a target's peak RSS (0 = off)")
+    ap.add_argument("--min-delta-ms", type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    main(ap.parse_args())
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+HTTP load replay against a running API (uvicorn or the procfile's gunicorn).
+
+Input is a JSONL request log, one request per line:
+  {"ts": 1760000000.12, "path": "/recommend", "query": "...", "topk": 10, "filters": {...}}
+Only `query` is required ("q" is accepted too); `ts` may be epoch seconds or
+ISO-8601; `path` defaults to /recommend; lines with "items" are sent to
+/recommend/batch as they are. --from-csv builds requests from a query CSV
+instead.
+
+Modes:
+  open loop    --rps R            requests start on a fixed schedule whatever the
+                                  server does (--poisson for random arrivals);
+               --timestamps       original inter-arrival times (/ --speedup)
+  closed loop  --users N          N users, each sends its next request when the
+                                  previous one returns
+  saturation   --sweep-rps 5,10,20,40   or   --sweep-users 1,2,4,8,16
+                                  one run per level, then the curve and knee
+
+Open-loop latency is measured from the scheduled start, so a server that
+falls behind is charged for the queueing it causes (no coordinated omission).
+
+Usage:
+  python bench/replay.py --url http://localhost:8000 --log logs/requests.jsonl --rps 20 --duration 60
+  python bench/replay.py --from-csv Data/train_queries.csv --sweep-rps 2,5,10,20,40 --slo-p99-ms 500
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+
+# ----------------------------
+# Input
+# ----------------------------
+def _ts(v) -> Optional[float]:
+    if v is None:
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    try:
+        return datetime.fromisoformat(str(v).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def load_log(path: str) -> List[Dict[str, Any]]:
+    reqs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if "items" in rec:
+                body = {"items": rec["items"]}
+                reqs.append({"path": rec.get("path", "/recommend/batch"), "body": body, "ts": _ts(rec.get("ts"))})
+                continue
+            q = rec.get("query", rec.get("q"))
+            if not q:
+                continue
+            body = {"query": q}
+            if rec.get("topk") is not None:
+                body["topk"] = int(rec["topk"])
+            if rec.get("filters"):
+                body["filters"] = rec["filters"]
+            reqs.append({"path": rec.get("path", "/recommend"), "body": body,
+                         "ts": _ts(rec.get("ts", rec.get("timestamp")))})
+    if not reqs:
+        raise SystemExit(f"No replayable requests in {path}")
+    return reqs
+
+def load_csv(path: str, topk: int) -> List[Dict[str, Any]]:
+    df = pd.read_csv(path)
+    col = next((c for c in df.columns if str(c).strip().lower() in {"query", "queries", "jd", "text"}),
+               df.columns[0])
+    return [{"path": "/recommend", "body": {"query": q, "topk": topk}, "ts": None}
+            for q in df[col].dropna().astype(str).tolist()]
+
+# ----------------------------
+# Runs
+# ----------------------------
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.started = time.perf_counter()
+        self.finished = self.started
+
+    def add(self, latency: float, status: str) -> None:
+        self.statuses[status] += 1
+        if status == "200":
+            self.latencies.append(latency)
+        self.finished = time.perf_counter()
+
+    def report(self, **extra) -> Dict[str, Any]:
+        n = sum(self.statuses.values())
+        ok = self.statuses.get("200", 0)
+        wall = max(1e-9, self.finished - self.started)
+        ms = np.asarray(self.latencies) * 1000.0
+        pct = {f"p{p}_ms": float(np.percentile(ms, p)) if len(ms) else None for p in (50, 90, 95, 99)}
+        return {
+            **extra,
+            "requests": n,
+            "ok": ok,
+            "error_rate": (n - ok) / n if n else 0.0,
+            "statuses": dict(self.statuses),
+            "throughput_rps": ok / wall,
+            **pct,
+            "max_ms": float(ms.max()) if len(ms) else None,
+        }
+
+async def _send(client: httpx.AsyncClient, req: Dict[str, Any], rec: Recorder, start: float) -> None:
+    try:
+        r = await client.post(req["path"], json=req["body"])
+        status = str(r.status_code)
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    rec.add(time.perf_counter() - start, status)
+
+def _cycle(reqs, n):
+    return [reqs[i % len(reqs)] for i in range(n)]
+
+async def open_loop(client, reqs, rps: Optional[float], duration: float, poisson: bool = False,
+                    timestamps: bool = False, speedup: float = 1.0, max_inflight: int = 1000) -> Dict[str, Any]:
+    """Fire requests on a schedule; latency counts from the scheduled start."""
+    if timestamps:
+        ts = [r["ts"] for r in reqs]
+        if any(t is None for t in ts):
+            raise SystemExit("--timestamps needs a ts on every log line")
+        offsets = [(t - ts[0]) / speedup for t in ts]
+        schedule = [(o, r) for o, r in zip(offsets, reqs) if not duration or o <= duration]
+    else:
+        n = max(1, int(rps * duration)) if duration else len(reqs)
+        schedule, t = [], 0.0
+        for r in _cycle(reqs, n):
+            schedule.append((t, r))
+            t += random.expovariate(rps) if poisson else 1.0 / rps
+
+    rec, tasks, dropped = Recorder(), set(), 0
+    t0 = time.perf_counter()
+    rec.started = t0
+    for offset, req in schedule:
+        delay = t0 + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_inflight:
+            dropped += 1   # the client itself is saturated; count it instead of queueing
+            rec.add(0.0, "client_dropped")
+            continue
+        task = asyncio.create_task(_send(client, req, rec, t0 + offset))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    offered = len(schedule) / max(1e-9, schedule[-1][0]) if len(schedule) > 1 else float(len(schedule))
+    return rec.report(mode="open", offered_rps=offered)
+
+async def closed_loop(client, reqs, users: int, duration: float, requests: int) -> Dict[str, Any]:
+    """N users in lock-step with the server; stops after `duration` s or `requests` total."""
+    if not duration and not requests:
+        requests = len(reqs)   # one pass over the log
+    rec = Recorder()
+    deadline = rec.started + duration if duration else None
+    sent = 0
+
+    async def user(uid: int):
+        nonlocal sent
+        i = uid
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if requests and sent >= requests:
+                return
+            sent += 1
+            await _send(client, reqs[i % len(reqs)], rec, time.perf_counter())
+            i += users
+
+    await asyncio.gather(*(user(u) for u in range(users)))
+    return rec.report(mode="closed", users=users)
+
+# ----------------------------
+# Saturation
+# ----------------------------
+def knee(rows: List[Dict[str, Any]], slo_p99_ms: float, key: str) -> Optional[Dict[str, Any]]:
+    """Last level that kept up (>= 95% of offered load for open loop) within the SLO and < 1% errors."""
+    best = None
+    for r in rows:
+        keeps_up = r["mode"] == "closed" or r["throughput_rps"] >= 0.95 * r["offered_rps"]
+        within = r["p99_ms"] is not None and (not slo_p99_ms or r["p99_ms"] <= slo_p99_ms)
+        if keeps_up and within and r["error_rate"] < 0.01:
+            best = r
+        else:
+            break
+    return {key: best[key], "throughput_rps": best["throughput_rps"], "p99_ms": best["p99_ms"]} if best else None
+
+def print_row(r: Dict[str, Any]) -> None:
+    level = f"rps={r['offered_rps']:.1f}" if r["mode"] == "open" else f"users={r['users']}"
+    fmt = lambda v: f"{v:8.1f}" if v is not None else "     n/a"  # noqa: E731
+    print(f"[REPLAY] {r['mode']:<6} {level:<12} n={r['requests']:<6} thr={r['throughput_rps']:7.2f}/s "
+          f"p50={fmt(r['p50_ms'])}ms p95={fmt(r['p95_ms'])}ms p99={fmt(r['p99_ms'])}ms "
+          f"err={r['error_rate'] * 100:5.1f}%")
+
+async def main(args):
+    reqs = load_csv(args.from_csv, args.topk) if args.from_csv else load_log(args.log)
+    if args.shuffle:
+        random.Random(0).shuffle(reqs)
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        for _ in range(args.warmup):
+            await client.post(reqs[0]["path"], json=reqs[0]["body"])
+
+        rows = []
+        if args.sweep_rps:
+            for rps in (float(x) for x in args.sweep_rps.split(",")):
+                rows.append(await open_loop(client, reqs, rps, args.duration, args.poisson,
+                                            max_inflight=args.max_inflight))
+                print_row(rows[-1])
+        elif args.sweep_users:
+            for users in (int(x) for x in args.sweep_users.split(",")):
+                rows.append(await closed_loop(client, reqs, users, args.duration, args.requests))
+                print_row(rows[-1])
+        elif args.users:
+            rows.append(await closed_loop(client, reqs, args.users, args.duration, args.requests))
+            print_row(rows[-1])
+        else:
+            rows.append(await open_loop(client, reqs, args.rps, args.duration, args.poisson,
+                                        args.timestamps, args.speedup, args.max_inflight))
+            print_row(rows[-1])
+
+    report = {"url": args.url, "source": args.from_csv or args.log, "runs": rows}
+    if len(rows) > 1:
+        report["saturation"] = knee(rows, args.slo_p99_ms, "offered_rps" if args.sweep_rps else "users")
+        print(f"[KNEE] {report['saturation']}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"[DONE] Wrote {args.out}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--log", default="logs/requests.jsonl", help="JSONL request log to replay")
+    ap.add_argument("--from-csv", default="", help="Replay queries from a CSV instead of a log")
+    ap.add_argument("--topk", type=int, default=10, help="topk for --from-csv requests")
+    ap.add_argument("--shuffle", action="store_true")
+    ap.add_argument("--rps", type=float, default=10.0, help="Open-loop request rate")
+    ap.add_argument("--poisson", action="store_true", help="Exponential inter-arrivals at --rps")
+    ap.add_argument("--timestamps", action="store_true", help="Replay the log's original inter-arrival times")
+    ap.add_argument("--speedup", type=float, default=1.0, help="Divide original inter-arrival times by this")
+    ap.add_argument("--users", type=int, default=0, help="Closed loop with N concurrent users")
+    ap.add_argument("--requests", type=int, default=0, help="Closed loop: stop after N requests")
+    ap.add_argument("--duration", type=float, default=30.0, help="Seconds per run (0 = whole log)")
+    ap.add_argument("--sweep-rps", default="", help="Open-loop saturation sweep, e.g. 5,10,20,40")
+    ap.add_argument("--sweep-users", default="", help="Closed-loop saturation sweep, e.g. 1,2,4,8")
+    ap.add_argument("--slo-p99-ms", type=float, default=0.0, help="p99 limit for the saturation knee")
+    ap.add_argument("--max-inflight", type=int, default=256, help="Client-side cap on open requests")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--warmup", type=int, default=3, help="Untimed requests before the first run")
+    ap.add_argument("--out", default="", help="JSON report path")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Sweep CPU thread budgets for serving and report throughput vs tail latency.
+
+For every (torch threads, FAISS threads, encode concurrency, client
+concurrency) combination, fires the query set at `search` from a client
+thread pool (like FastAPI's threadpool under load) and reports QPS and
+p50/p95/p99. Pick the row with the best QPS whose p99 meets your SLO and
+set SHL_TORCH_THREADS / SHL_FAISS_THREADS / SHL_ENCODE_CONCURRENCY.
+
+Usage:
+  python bench/thread_sweep.py --indexdir index \
+    --torch-threads 1,2,4 --faiss-threads 1 --encode-concurrency 1,2,4 \
+    --clients 8 --out thread_sweep.json
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.retriever import configure_query_cache, load_index, search, set_thread_budget  # noqa: E402
+
+def _ints(s: str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def load_queries(path: str, limit: int):
+    df = pd.read_csv(path)
+    col = next((c for c in df.columns if str(c).strip().lower() in {"query", "queries", "jd", "text"}),
+               df.columns[0])
+    qs = df[col].dropna().astype(str).drop_duplicates().tolist()
+    return qs[:limit] if limit else qs
+
+def run_setting(bundle, queries, clients: int, topk: int):
+    # every setting starts cold so repeated texts still hit the transformer
+    configure_query_cache(maxsize=0)
+    lat = []
+
+    def one(q):
+        t0 = time.perf_counter()
+        search(bundle, q, topk=topk)
+        lat.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(clients) as ex:
+        list(ex.map(one, queries))
+    wall = time.perf_counter() - t0
+    ms = np.array(lat) * 1000.0
+    return {
+        "qps": len(queries) / wall,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+def main(args):
+    bundle = load_index(args.indexdir, model_name=args.model)
+    queries = load_queries(args.queries, args.limit) * args.repeat
+    search(bundle, queries[0], topk=args.topk)   # warmup
+
+    rows = []
+    grid = itertools.product(_ints(args.torch_threads), _ints(args.faiss_threads),
+                             _ints(args.encode_concurrency), _ints(args.clients))
+    for tt, ft, ec, cl in grid:
+        # the FAISS count is picked up by each client thread on its next search
+        set_thread_budget(tt, ft, ec)
+        res = {"torch_threads": tt, "faiss_threads": ft, "encode_concurrency": ec, "clients": cl,
+               **run_setting(bundle, queries, cl, args.topk)}
+        rows.append(res)
+        print(f"[SWEEP] torch={tt:<2} faiss={ft:<2} encode={ec:<2} clients={cl:<3} "
+              f"qps={res['qps']:7.2f}  p50={res['p50_ms']:7.1f}ms  "
+              f"p95={res['p95_ms']:7.1f}ms  p99={res['p99_ms']:7.1f}ms")
+
+    best = max(rows, key=lambda r: r["qps"])
+    if args.slo_p99_ms:
+        ok = [r for r in rows if r["p99_ms"] <= args.slo_p99_ms]
+        best = max(ok, key=lambda r: r["qps"]) if ok else min(rows, key=lambda r: r["p99_ms"])
+    print(f"[BEST] {best}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"cpu_count": os.cpu_count(), "results": rows, "best": best}, f, indent=2)
+        print(f"[DONE] Wrote {args.out}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--indexdir", default="index")
+    ap.add_argument("--model", default=None, help="Default: the model in the index manifest")
+    ap.add_argument("--queries", default="Data/train_queries.csv")
+    ap.add_argument("--limit", type=int, default=0, help="Use at most N distinct queries")
+    ap.add_argument("--repeat", type=int, default=3, help="Repeat the query set N times")
+    ap.add_argument("--topk", type=int, default=40, help="Same overfetch as /recommend (10 * 4)")
+    ap.add_argument("--torch-threads", default="1,2,4")
+    ap.add_argument("--faiss-threads", default="1")
+    ap.add_argument("--encode-concurrency", default="1,2,4")
+    ap.add_argument("--clients", default="8", help="Concurrent client threads (comma list)")
+    ap.add_argument("--slo-p99-ms", type=float, default=0.0, help="Pick the best QPS under this p99")
+    ap.add_argument("--out", default="", help="Optional JSON report path")
+    main(ap.parse_args())
@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+#
+# Multi-worker deployment with the index + model loaded ONCE in the master
+# (preload_app) and shared copy-on-write by all workers:
+#   gunicorn -c gunicorn.conf.py src.api_fastapi:app
+#
+# Per-worker memory (rss / pss / uss) is reported on /health and /metrics;
+# uss is what each extra worker really costs.
+import os
+
+# picked up by src/api_fastapi.py when gunicorn imports it in the master
+os.environ.setdefault("SHL_PRELOAD", "1")
+# file-backed vectors/index pages stay shared even after a worker touches them
+os.environ.setdefault("SHL_INDEX_MMAP", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+
+def post_fork(server, worker):
+    server.log.info("worker %s forked from preloaded master", worker.pid)
@@ -1,156 +1,671 @@
 #!/usr/bin/env python3
 # src/api_fastapi.py
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional
+import gc
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+import os
+import math
 import pandas as pd
-import re
+import threading
+import time
 
-from src.retriever import load_index, search
+from src.batcher import MicroBatcher
+from src.cross_encoder import CrossEncoderReranker
+from src import metrics, profiling
+from src.filters import combine_masks
+from src.metrics import REGISTRY, Counter, Histogram, gauge_lines, process_memory, run_with_timings, span
+from src.rerank import postings_mask, rerank_candidates, strong_terms_from_query
+from src.request_log import RequestLog, query_hash
+from src.result_cache import ResultCache
+from src.retriever import (MANIFEST_FILE, filter_mask, index_version, load_index, query_cache_stats,
+                           read_manifest, resolve_index_dir, search, search_many, set_thread_budget, thread_budget)
 
 APP_TITLE = "SHL GenAI Assessment Recommendation API"
-MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"   # MUST match your built index
+MODEL_NAME = os.environ.get("SHL_MODEL_NAME") or None   # None = the model in the index manifest
 INDEX_DIR  = "index"
+INDEX_MMAP = os.environ.get("SHL_INDEX_MMAP", "0") == "1"   # share index pages across workers
+ENCODER_BACKEND = os.environ.get("SHL_ENCODER_BACKEND", "torch")   # torch | onnx | onnx-int8
+RETRIEVAL = os.environ.get("SHL_RETRIEVAL", "dense")              # dense | hybrid (BM25 + dense)
+FUSION = os.environ.get("SHL_FUSION", "rrf")                        # rrf | weighted
+BATCH_MAX_SIZE = int(os.environ.get("SHL_BATCH_MAX_SIZE", "16"))     # <= 1 disables micro-batching
+BATCH_MAX_WAIT_MS = float(os.environ.get("SHL_BATCH_MAX_WAIT_MS", "5"))
+RESULT_CACHE_SIZE = int(os.environ.get("SHL_RESULT_CACHE_SIZE", "2048"))   # 0 disables
+RESULT_CACHE_TTL = float(os.environ.get("SHL_RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_DB = os.environ.get("SHL_RESULT_CACHE_DB") or None           # e.g. cache/results.sqlite
+RESULT_CACHE_DB_ROWS = int(os.environ.get("SHL_RESULT_CACHE_DB_ROWS", "100000"))  # SQLite row cap; 0 = none
+BULK_MAX_ITEMS = int(os.environ.get("SHL_BULK_MAX_ITEMS", "1000"))  # /recommend/batch request cap
+BULK_CHUNK_SIZE = int(os.environ.get("SHL_BULK_CHUNK_SIZE", "64"))  # queries per encode + search
+# CPU budget per worker (unset = library defaults, i.e. all cores per request)
+TORCH_THREADS = int(os.environ.get("SHL_TORCH_THREADS", "0")) or None
+FAISS_THREADS = int(os.environ.get("SHL_FAISS_THREADS", "0")) or None
+ENCODE_CONCURRENCY = int(os.environ.get("SHL_ENCODE_CONCURRENCY", "0")) or None
+ADMIN_TOKEN = os.environ.get("SHL_ADMIN_TOKEN", "")                 # enables /admin/* when set
+RELOAD_WATCH_SECONDS = float(os.environ.get("SHL_RELOAD_WATCH_SECONDS", "0"))  # poll index/CURRENT; 0 = off
+RELOAD_WARM_QUERIES = int(os.environ.get("SHL_RELOAD_WARM_QUERIES", "200"))   # recent queries re-run on reload
+# optional cross-encoder second stage, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (empty = off)
+CROSS_ENCODER = os.environ.get("SHL_CROSS_ENCODER", "")
+CROSS_ENCODER_TOP_N = int(os.environ.get("SHL_CROSS_ENCODER_TOP_N", "20"))
+CROSS_ENCODER_BUDGET_MS = float(os.environ.get("SHL_CROSS_ENCODER_BUDGET_MS", "150"))  # per request
+# JSONL request log for replay/offline eval, e.g. logs/requests.{pid}.jsonl (empty = off)
+REQUEST_LOG = os.environ.get("SHL_REQUEST_LOG", "")
+REQUEST_LOG_TEXT = os.environ.get("SHL_REQUEST_LOG_TEXT", "1") == "1"   # 0 = store only a query hash
+REQUEST_LOG_QUEUE = int(os.environ.get("SHL_REQUEST_LOG_QUEUE", "10000"))
+REQUEST_LOG_MAX_MB = float(os.environ.get("SHL_REQUEST_LOG_MAX_MB", "50"))
+REQUEST_LOG_BACKUPS = int(os.environ.get("SHL_REQUEST_LOG_BACKUPS", "5"))
+# POST /admin/profile: allowed with the admin token, or for anyone when SHL_PROFILE=1 (dev only)
+PROFILE_OPEN = os.environ.get("SHL_PROFILE", "0") == "1"
+PROFILE_DIR = os.environ.get("SHL_PROFILE_DIR", "")   # also keep every profile as .pstats here
+PRELOAD = os.environ.get("SHL_PRELOAD", "0") == "1"   # load once in the gunicorn master (gunicorn.conf.py)
+
+WARMUP_QUERIES = [
+    "Java developer with SQL skills",
+    "Hiring a data analyst with Excel, statistics and stakeholder communication. 60 minutes",
+    "Entry-level sales associate, customer service, personality assessment",
+]
+
+# ----------------------------
+# Load FAISS index + model (in the background, see lifespan)
+# ----------------------------
+bundle = None
+cross_encoder = None   # CrossEncoderReranker when SHL_CROSS_ENCODER is set
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_DB,
+                           salt=f"ce={CROSS_ENCODER}:{CROSS_ENCODER_TOP_N}" if CROSS_ENCODER else "",
+                           db_max_rows=RESULT_CACHE_DB_ROWS)
+encode_executor = (ThreadPoolExecutor(ENCODE_CONCURRENCY, thread_name_prefix="encode")
+                   if ENCODE_CONCURRENCY else None)
+batcher = (MicroBatcher(search_many, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, executor=encode_executor)
+           if BATCH_MAX_SIZE > 1 else None)
+request_log = (RequestLog(REQUEST_LOG, REQUEST_LOG_QUEUE, int(REQUEST_LOG_MAX_MB * 1024 * 1024),
+                          REQUEST_LOG_BACKUPS) if REQUEST_LOG else None)
+load_state: Dict[str, Any] = {"status": "starting", "error": None, "load_seconds": None}
+reload_state: Dict[str, Any] = {"status": "idle", "error": None, "last_reload": None, "reloads": 0}
+_reload_lock = threading.Lock()
+# recent distinct (query, topk, filters) served, replayed against a new bundle before the swap
+recent_requests: deque = deque(maxlen=max(0, RELOAD_WARM_QUERIES))
+
+def _load_bundle(model=None):
+    print(f"[INFO] Loading index '{resolve_index_dir(INDEX_DIR)}' with model '{MODEL_NAME or 'from manifest'}' ...")
+    return load_index(INDEX_DIR, model_name=MODEL_NAME, mmap=INDEX_MMAP, backend=ENCODER_BACKEND,
+                      retrieval=RETRIEVAL, fusion=FUSION, encoder_threads=TORCH_THREADS, model=model)
+
+def _load_cross_encoder():
+    if not CROSS_ENCODER:
+        return None
+    print(f"[INFO] Loading cross-encoder '{CROSS_ENCODER}' (top {CROSS_ENCODER_TOP_N}, "
+          f"budget {CROSS_ENCODER_BUDGET_MS:g} ms) ...")
+    return CrossEncoderReranker(CROSS_ENCODER, top_n=CROSS_ENCODER_TOP_N, budget_ms=CROSS_ENCODER_BUDGET_MS)
+
+def _warm(b):
+    # warm the allocator, torch thread pool and FAISS search path
+    # (bypasses the query cache so warmup texts do not occupy it)
+    k = max(10, cross_encoder.top_n) if cross_encoder is not None else 10
+    for wq in WARMUP_QUERIES:
+        x = b.model.encode([wq], normalize_embeddings=True).astype("float32")
+        D, I = b.index.search(x, k)
+        if cross_encoder is not None:
+            # calibrates the per-pair cost estimate the latency budget relies on
+            cross_encoder.warm(wq, b.meta.iloc[[i for i in I[0] if i >= 0]])
+
+def _preload():
+    """
+    Preload mode: runs at import in the gunicorn master, before workers fork,
+    so every worker inherits the model/index pages copy-on-write. No warmup
+    here: torch/OpenMP thread pools must be created after fork, per worker.
+    gc.freeze() moves everything loaded so far into the permanent generation,
+    so the collector never writes to those objects' headers in the workers
+    and un-shares their pages.
+    """
+    global cross_encoder
+    t0 = time.perf_counter()
+    b = _load_bundle()
+    cross_encoder = _load_cross_encoder()
+    gc.freeze()
+    print(f"[INFO] Preloaded index and model in {time.perf_counter() - t0:.2f}s (pid {os.getpid()}).")
+    return b
+
+_preloaded = _preload() if PRELOAD else None
+
+def _load_and_warm():
+    """Load index + model (unless preloaded), run a few warmup encodes, then publish `bundle`."""
+    global bundle, cross_encoder
+    t0 = time.perf_counter()
+    load_state["status"] = "loading"
+    try:
+        # per worker (after any fork): pin torch/FAISS threads, cap concurrent encodes
+        set_thread_budget(TORCH_THREADS, FAISS_THREADS, ENCODE_CONCURRENCY)
+        b = _preloaded if _preloaded is not None else _load_bundle()
+        if cross_encoder is None:
+            cross_encoder = _load_cross_encoder()
+        _warm(b)
+        result_cache.set_version(b.version)   # drops entries of any previous index
+        bundle = b
+        load_state.update(status="ready", load_seconds=round(time.perf_counter() - t0, 3))
+        print(f"[READY] Index and model loaded in {load_state['load_seconds']}s.")
+    except Exception as e:
+        load_state.update(status="failed", error=f"{type(e).__name__}: {e}")
+        print(f"[ERROR] Could not load index/model: {e}")
+
+# ----------------------------
+# Hot reload (atomic bundle swap)
+# ----------------------------
+def reload_index(force: bool = False) -> bool:
+    """
+    Load the index that INDEX_DIR currently points at, warm it, and swap it in.
+    The model is reused when the new manifest names the same one, so the
+    query-embedding cache stays valid. Recent requests are recomputed on the new bundle and seeded
+    into the result cache under the new version before the swap. Requests
+    already running keep the bundle they pinned. Returns False if the
+    target is already live (and not forced) or another reload is running.
+    """
+    global bundle
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        old = bundle
+        target = str(resolve_index_dir(INDEX_DIR))
+        if old is not None and not force and old.indexdir == target and old.version == index_version(
+                target, extra=(old.model_name, old.backend, old.retrieval, old.fusion)):
+            return False
+        reload_state.update(status="loading", error=None)
+        t0 = time.perf_counter()
+        manifest = read_manifest(target)
+        same_model = old is not None and (manifest is None or manifest["model"]["name"] == old.model_name)
+        nb = _load_bundle(model=old.model if same_model else None)
+        _warm(nb)
+
+        warmed = {}
+        # list() copies the deque in one step; recommend() keeps appending on the event loop
+        recent = list(recent_requests)
+        for q, topk, filters in {result_cache.make_key("", *r): r for r in recent}.values():
+            allow = allowed_rows(nb, q, filters)
+            if allow is not None and not allow.any():
+                continue
+            df = search(nb, q, topk * 4, None, allow)
+            out = rerank_and_build(nb, q, topk, df)
+            if out.get("reranker") != "bi-encoder":
+                warmed[result_cache.make_key(nb.version, q, topk, filters)] = out
+
+        result_cache.set_version(nb.version)
+        for key, out in warmed.items():
+            result_cache.put(key, out)
+        bundle = nb   # single reference assignment: atomic for readers
+        if load_state["status"] != "ready":
+            load_state.update(status="ready", error=None)
+        reload_state.update(status="idle", last_reload=time.time(), reloads=reload_state["reloads"] + 1,
+                            seconds=round(time.perf_counter() - t0, 3), indexdir=target,
+                            warmed_results=len(warmed))
+        print(f"[READY] Reloaded index from {target} in {reload_state['seconds']}s "
+              f"({len(warmed)} cached results re-warmed).")
+        return True
+    except Exception as e:
+        reload_state.update(status="failed", error=f"{type(e).__name__}: {e}")
+        print(f"[ERROR] Reload failed, keeping the current index: {e}")
+        return False
+    finally:
+        _reload_lock.release()
+
+def _watch_index_dir():
+    """
+    Poll INDEX_DIR and reload on change: its CURRENT pointer, or the live dir's
+    manifest.json, which the indexer writes (or os.replaces) after every other
+    file. faiss.index is only watched in dirs built before manifests existed.
+    Each change is tried once: a failed reload waits for the next publish
+    rather than retrying every poll. This also recovers a worker whose
+    initial load failed.
+    """
+    def stamp():
+        try:
+            root = resolve_index_dir(INDEX_DIR)
+            f = root / MANIFEST_FILE
+            if not f.exists():
+                f = root / "faiss.index"
+            return (str(root), f.stat().st_mtime_ns if f.exists() else None)
+        except OSError:
+            return None   # mid-switch or unreadable; look again next poll
+
+    seen = stamp()   # what the initial load is reading
+    while True:
+        time.sleep(RELOAD_WATCH_SECONDS)
+        cur = stamp()
+        if cur is None or cur == seen:
+            continue
+        if (bundle is None and load_state["status"] in ("starting", "loading")) or _reload_lock.locked():
+            continue   # a load is running; compare again once it is done
+        seen = cur
+        reload_index(force=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bind immediately; loading happens off the event loop so /health answers at once.
+    threading.Thread(target=_load_and_warm, name="index-loader", daemon=True).start()
+    if RELOAD_WATCH_SECONDS > 0:
+        threading.Thread(target=_watch_index_dir, name="index-watcher", daemon=True).start()
+    if request_log is not None:
+        request_log.start()   # per worker: the writer thread must start after fork
+    if batcher is not None:
+        await batcher.start()
+    yield
+    if batcher is not None:
+        await batcher.stop()
+    if request_log is not None:
+        request_log.close()
 
 app = FastAPI(
     title=APP_TITLE,
     description="RAG API that recommends SHL assessments from the product catalog.",
     version="1.1.0",
+    lifespan=lifespan,
 )
 
 # ----------------------------
-# Load FAISS index + model
+# Metrics
 # ----------------------------
-try:
-    print(f"[INFO] Loading index '{INDEX_DIR}' with model '{MODEL_NAME}' ...")
-    bundle = load_index(INDEX_DIR, model_name=MODEL_NAME)
-    print("[READY] Index and model loaded.")
-except Exception as e:
-    bundle = None
-    print(f"[WARN] Could not load index/model: {e}")
+REQUESTS = REGISTRY.register(Counter(
+    "shl_requests_total", "HTTP requests by path and status.", ["path", "status"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "shl_request_seconds", "End-to-end request latency.", ["path"]))
+QUERY_CHARS = REGISTRY.register(Histogram(
+    "shl_request_query_chars", "Query length in characters.",
+    buckets=(50, 100, 250, 500, 1000, 2500, 5000, 10000)))
+BATCH_ITEMS = REGISTRY.register(Histogram(
+    "shl_request_batch_items", "Items per /recommend/batch request.",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)))
+RESULT_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "shl_result_cache_lookups_total", "Response cache lookups.", ["result"]))
+EMPTY_RESULTS = REGISTRY.register(Counter(
+    "shl_empty_results_total", "Recommendations that came back empty after filtering.", ["path"]))
+
+def _cache_metrics():
+    lines = []
+    stats = {"query": query_cache_stats(), "result": result_cache.stats()}
+    for field in ("hits", "misses", "evictions", "expirations"):
+        lines += gauge_lines(f"shl_cache_{field}_total", f"Cache {field}.",
+                             {(("cache", c),): st[field] for c, st in stats.items()}, kind="counter")
+    lines += gauge_lines("shl_cache_entries", "Entries currently cached.",
+                         {(("cache", c),): st["size"] for c, st in stats.items()})
+    if batcher is not None:
+        bs = batcher.stats()
+        lines += gauge_lines("shl_batcher_mean_batch_size", "Mean micro-batch size.",
+                             {(): bs["mean_batch_size"]})
+    if request_log is not None:
+        rl = request_log.stats()
+        lines += gauge_lines("shl_request_log_records_total", "Request log records by outcome.",
+                             {(("outcome", o),): rl[o] for o in ("written", "dropped")}, kind="counter")
+        lines += gauge_lines("shl_request_log_queue_depth", "Request log records waiting for the writer.",
+                             {(): rl["queued"]})
+    if cross_encoder is not None:
+        ce = cross_encoder.stats()
+        lines += gauge_lines("shl_cross_encoder_requests_total",
+                             "Cross-encoder stage outcomes (skipped_budget = fell back to bi-encoder order).",
+                             {(("outcome", o),): ce[o] for o in ("scored", "cached", "skipped_budget", "overrun")},
+                             kind="counter")
+        lines += gauge_lines("shl_cross_encoder_ms_per_pair", "EWMA cost estimate per scored pair.",
+                             {(): ce["ms_per_pair"] or 0.0})
+    return lines
+
+def _memory_metrics():
+    mem = process_memory()
+    pid = str(os.getpid())
+    return gauge_lines("shl_process_memory_bytes",
+                       "Worker memory from /proc/self/smaps_rollup (uss = private, pss = proportional share).",
+                       {(("pid", pid), ("kind", k)): v for k, v in mem.items()})
+
+REGISTRY.add_collector(_cache_metrics)
+REGISTRY.add_collector(_memory_metrics)
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Collect per-stage timings for this request into the Server-Timing header."""
+    timings = {}
+    token = metrics.request_timings.set(timings)
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.request_timings.reset(token)
+    elapsed = time.perf_counter() - t0
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or (request.url.path if response.status_code != 404 else "unmatched")
+    REQUESTS.inc(path=path, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, path=path)
+    timings["total"] = elapsed
+    response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
 
 # ----------------------------
 # Request schema
 # ----------------------------
+class SearchFilters(BaseModel):
+    test_type: Optional[List[str]] = None   # e.g. ["K"]; values OR-ed within a field
+    level: Optional[List[str]] = None
+    language: Optional[List[str]] = None
+    min_duration: Optional[float] = None    # minutes; rows without a duration are excluded
+    max_duration: Optional[float] = None
+
 class QueryInput(BaseModel):
     query: str
     topk: int = 10   # we clamp to [1, 10]
+    filters: Optional[SearchFilters] = None
 
-# ----------------------------
-# Utilities
-# ----------------------------
-def extract_duration_window(text: str):
-    """
-    Return (min_min, max_min) if query mentions duration like:
-      - '40 minutes'
-      - '1-2 hours'
-      - 'about 60 min'
-    Otherwise return None.
-    """
-    t = (text or "").lower()
-
-    # Range, e.g. "1-2 hour(s)" or "45-60 min"
-    m = re.search(r"(\d+)\s*-\s*(\d+)\s*(hour|hr|hours|hrs|minute|min|minutes)\b", t)
-    if m:
-        a, b, unit = int(m.group(1)), int(m.group(2)), m.group(3)
-        if "hour" in unit:
-            a, b = a * 60, b * 60
-        return (min(a, b), max(a, b))
-
-    # Single value, e.g. "60 minutes", "1 hour"
-    m = re.search(r"(\d+)\s*(hour|hr|hours|hrs|minute|min|minutes)\b", t)
-    if m:
-        v, unit = int(m.group(1)), m.group(2)
-        if "hour" in unit:
-            v = v * 60
-        # soft window around target
-        return (max(0, v - 15), v + 15)
-
-    return None
-
-def strong_terms_from_query(q: str) -> List[str]:
-    # Extract words and keep a small whitelist of useful “strong” terms
-    words = [w.lower() for w in re.findall(r"[a-zA-Z]+", q or "")]
-    whitelist = {
-        "python","sql","excel","powerbi","tableau","r","statistics","statistical",
-        "developer","engineer","analyst","data","qa","testing","automation",
-        "communication","stakeholder","manager","sales","marketing","java","javascript"
-    }
-    return [w for w in words if w in whitelist]
+class BatchInput(BaseModel):
+    # validated per item in the handler, so one bad item (even a non-object) fails alone
+    items: List[Any]
 
 # ----------------------------
 # Endpoints
 # ----------------------------
 @app.get("/health")
 def health():
-    return {"status": "ok", "index_loaded": bundle is not None, "model": MODEL_NAME}
+    """Liveness: the process is up and serving HTTP (index may still be loading)."""
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "memory": process_memory(),
+        "index_loaded": bundle is not None,
+        "model": bundle.model_name if bundle is not None else MODEL_NAME,
+        "backend": ENCODER_BACKEND,
+        "retrieval": RETRIEVAL,
+        "query_cache": query_cache_stats(),
+        "batcher": batcher.stats() if batcher is not None else None,
+        "threads": thread_budget,
+        "index_dir": bundle.indexdir if bundle is not None else None,
+        "index_version": bundle.version if bundle is not None else None,
+        "reload": reload_state,
+        "cross_encoder": cross_encoder.stats() if cross_encoder is not None else None,
+        "request_log": request_log.stats() if request_log is not None else None,
+        "result_cache": result_cache.stats(),
+    }
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 only once the index and model are loaded and warmed."""
+    body = {"ready": bundle is not None, **load_state}
+    return JSONResponse(body, status_code=200 if bundle is not None else 503)
+
+def _admin_ok(token: str) -> bool:
+    """Admin token check in constant time (no early exit on the first wrong byte)."""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.post("/admin/reload", status_code=202)
+def admin_reload(force: bool = False, x_admin_token: str = Header(default="")):
+    """Start a background reload of INDEX_DIR (versioned dirs follow CURRENT)."""
+    if not _admin_ok(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled or the token is wrong.")
+    if reload_state["status"] == "loading":
+        return {"started": False, "reload": reload_state}
+    threading.Thread(target=reload_index, kwargs={"force": force}, name="index-reload", daemon=True).start()
+    return {"started": True, "target": str(resolve_index_dir(INDEX_DIR)), "reload": reload_state}
+
+@app.post("/admin/profile")
+def admin_profile(inp: QueryInput, format: str = "json", top: int = 25, save: bool = False,
+                  x_admin_token: str = Header(default="")):
+    """
+    Run one /recommend under cProfile and report where the time went, per
+    library (torch, faiss, pandas, regex, ...) and per function. Bypasses
+    the result cache, the query-embedding cache and the micro-batcher so the
+    whole pipeline runs in this thread. format=json (summary), text
+    (pstats listing) or pstats (binary dump for snakeviz / `python -m pstats`).
+
+    On Python 3.12+ the profiler is process-wide: requests this worker serves
+    meanwhile are included in the profile (and slowed by it), so profile an
+    idle worker. One profile per worker at a time; 409 while one is running.
+    """
+    if not PROFILE_OPEN and not _admin_ok(x_admin_token):
+        raise HTTPException(status_code=403, detail="Profiling needs the admin token (or SHL_PROFILE=1).")
+    b = _pinned_bundle()
+    q, topk, filters = _parse_input(inp)
+
+    def run():
+        allow = allowed_rows(b, q, filters)
+        if allow is not None and not allow.any():
+            return {"query": q, "count": 0, "recommendations": []}
+        df = search(b, q, topk * 4, None, allow, use_cache=False)
+        return rerank_and_build(b, q, topk, df)
+
+    try:
+        (out, stats, wall), timings = run_with_timings(profiling.profile_call, run)
+    except profiling.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker; retry.")
+    saved = None
+    if save or PROFILE_DIR:
+        saved = str(profiling.save(stats, PROFILE_DIR or "profiles", query_hash(q)))
+
+    if format == "pstats":
+        return Response(profiling.pstats_bytes(stats), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{query_hash(q)}.pstats"'})
+    if format == "text":
+        return PlainTextResponse(profiling.pstats_text(stats, top))
+    return {
+        "query_chars": len(q),
+        "wall_ms": round(wall * 1000.0, 3),
+        "stages_ms": {k: round(v * 1000.0, 3) for k, v in timings.items()},
+        "by_library_ms": profiling.breakdown(stats),
+        "top_functions": profiling.top_functions(stats, top),
+        "saved": saved,
+        "result": out,
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def root():
     return {"message": "Welcome to the SHL GenAI Assessment Recommendation API. See /docs for usage."}
 
-@app.post("/recommend")
-def recommend(inp: QueryInput) -> Dict[str, Any]:
-    if bundle is None:
-        raise HTTPException(status_code=503, detail="Index not loaded. Build index and restart API.")
+def _pinned_bundle():
+    """Current bundle, pinned by the caller for the whole request; 503 if not loaded."""
+    b = bundle
+    if b is None:
+        if load_state["status"] == "failed":
+            raise HTTPException(status_code=503, detail=f"Index failed to load: {load_state['error']}")
+        raise HTTPException(status_code=503, detail="Index is still loading. Retry shortly.")
+    return b
 
+def _parse_input(inp: QueryInput):
+    """(query, clamped topk, filters dict or None); 400 on an empty query."""
     q = (inp.query or "").strip()
     if not q:
         raise HTTPException(status_code=400, detail="Empty query.")
-
     topk = max(1, min(10, int(inp.topk or 10)))
+    filters = inp.filters.model_dump(exclude_none=True) if inp.filters else None
+    return q, topk, filters
 
-    # Retrieve a wider pool, then filter/rerank
-    df = search(bundle, q, topk=topk * 4)
+@app.post("/recommend")
+async def recommend(inp: QueryInput) -> Dict[str, Any]:
+    arrived = time.time()   # wall clock at arrival: replay --timestamps needs arrival gaps
+    started = time.perf_counter()
+    b = _pinned_bundle()
+    q, topk, filters = _parse_input(inp)
+    QUERY_CHARS.observe(len(q))
 
-    # ---------- Keyword relevance gate (keeps on-topic items)
-    strong = strong_terms_from_query(q)
-    if strong:
-        def on_topic(row):
-            text = " ".join(str(row.get(c, "") or "") for c in ["title","description","tags","category"]).lower()
-            return any(k in text for k in strong)
-        df = df[df.apply(on_topic, axis=1)]
-
-    # ---------- Duration awareness (soft boost if user asked for time)
-    win = extract_duration_window(q)
-    if win and "duration_min" in df.columns:
-        lo, hi = win
-        center = (lo + hi) / 2.0
-        def dur_score(row):
-            d = row.get("duration_min")
-            if d is None or pd.isna(d):
-                return 0.0
-            try:
-                d = float(d)
-            except Exception:
-                return 0.0
-            # linear falloff around the center; tolerance ~= max(15, half the window)
-            return max(0.0, 1.0 - abs(d - center) / max(15.0, (hi - lo) / 2.0))
-        df["_dur_score"] = df.apply(dur_score, axis=1)
+    with span("cache"):
+        key = result_cache.make_key(b.version, q, topk, filters)
+        cached = result_cache.get_memory(key)
+        if cached is None and result_cache.db_path:
+            # SQLite reads block; keep them off the event loop (writes go to a background thread)
+            cached = await run_in_threadpool(result_cache.get_disk, key)
+    RESULT_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        _log_request(b, q, topk, filters, cached, "hit", started, arrived)
+        return cached
+
+    # Structured filters + keyword gate become a row mask pushed into the index search
+    allow = allowed_rows(b, q, filters)
+    if allow is not None and not allow.any():
+        out = {"query": q, "count": 0, "recommendations": []}
     else:
-        df["_dur_score"] = 0.0
+        # Retrieve a wider pool for the duration rerank (coalesced with concurrent requests)
+        if batcher is not None:
+            df = await batcher.submit(b, q, topk * 4, allow)
+        else:
+            df = await run_in_threadpool(search, b, q, topk * 4, None, allow)
+        deadline = started + CROSS_ENCODER_BUDGET_MS / 1000.0
+        out = await run_in_threadpool(rerank_and_build, b, q, topk, df, deadline)
+    if out["count"] == 0:
+        EMPTY_RESULTS.inc(path="/recommend")
+    if _cacheable(b, out):
+        result_cache.put(key, out)
+        recent_requests.append((q, topk, filters))
+    _log_request(b, q, topk, filters, out, "miss", started, arrived)
+    return out
 
-    # ---------- Final score = 0.85 * semantic + 0.15 * duration_fit
-    if "similarity" in df.columns:
-        df["_final"] = 0.85 * df["similarity"].astype(float) + 0.15 * df["_dur_score"].astype(float)
-        df = df.sort_values("_final", ascending=False)
+def _log_request(b, q: str, topk: int, filters, out: Dict[str, Any], cache: str,
+                 started: float, arrived: float) -> None:
+    """One JSONL record per /recommend (dropped, never awaited, if the writer falls behind)."""
+    if request_log is None:
+        return
+    rec = {
+        "ts": arrived,
+        "path": "/recommend",
+        "query_hash": query_hash(q),
+        "topk": topk,
+        "filters": filters,
+        "cache": cache,
+        "count": out["count"],
+        "results": [r["assessment_url"] for r in out["recommendations"]],
+        "timings_ms": {k: round(v * 1000.0, 3) for k, v in (metrics.request_timings.get() or {}).items()},
+        "handler_ms": round((time.perf_counter() - started) * 1000.0, 3),
+        "index_version": b.version,
+        "pid": os.getpid(),
+    }
+    if REQUEST_LOG_TEXT:
+        rec["query"] = q
+    if "reranker" in out:
+        rec["reranker"] = out["reranker"]
+    request_log.log(rec)
 
-    # Keep top-K
-    df = df.head(topk)
+@app.post("/recommend/batch")
+def recommend_batch(inp: BatchInput) -> Dict[str, Any]:
+    """
+    Bulk /recommend: items are encoded and searched in chunks of
+    BULK_CHUNK_SIZE (one forward pass per chunk), then reranked one by one.
+    Results come back in input order; a bad item gets {"ok": false, "error"}
+    without failing the rest. The cross-encoder budget is per request, shared
+    by all items: once it is spent, later items keep the bi-encoder order.
+    """
+    started = time.perf_counter()
+    b = _pinned_bundle()
+    if len(inp.items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} items per batch.")
+    BATCH_ITEMS.observe(len(inp.items))
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(inp.items)
+    todo = []   # (position, query, topk, allow, cache key)
+    for i, item in enumerate(inp.items):
+        try:
+            q, topk, filters = _parse_input(QueryInput.model_validate(item))
+            QUERY_CHARS.observe(len(q))
+            key = result_cache.make_key(b.version, q, topk, filters)
+            cached = result_cache.get(key)
+            RESULT_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+            if cached is not None:
+                results[i] = {"index": i, "ok": True, **cached}
+                continue
+            allow = allowed_rows(b, q, filters)
+        except HTTPException as e:
+            results[i] = {"index": i, "ok": False, "error": e.detail}
+            continue
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err["loc"] else err["msg"]
+                               for err in e.errors())
+            results[i] = {"index": i, "ok": False, "error": f"Invalid item: {errors}"}
+            continue
+        except Exception as e:
+            results[i] = {"index": i, "ok": False, "error": f"{type(e).__name__}: {e}"}
+            continue
+        if allow is not None and not allow.any():
+            EMPTY_RESULTS.inc(path="/recommend/batch")
+            results[i] = {"index": i, "ok": True, "query": q, "count": 0, "recommendations": []}
+        else:
+            todo.append((i, q, topk, allow, key))
+
+    deadline = started + CROSS_ENCODER_BUDGET_MS / 1000.0
+    for start in range(0, len(todo), max(1, BULK_CHUNK_SIZE)):
+        chunk = todo[start:start + BULK_CHUNK_SIZE]
+        try:
+            frames = search_many(b, [c[1] for c in chunk], [c[2] * 4 for c in chunk],
+                                 allow=[c[3] for c in chunk])
+        except Exception as e:
+            for c in chunk:
+                results[c[0]] = {"index": c[0], "ok": False, "error": f"search failed: {e}"}
+            continue
+        for (i, q, topk, _, key), df in zip(chunk, frames):
+            try:
+                out = rerank_and_build(b, q, topk, df, deadline)
+                if out["count"] == 0:
+                    EMPTY_RESULTS.inc(path="/recommend/batch")
+                if _cacheable(b, out):
+                    result_cache.put(key, out)
+                results[i] = {"index": i, "ok": True, **out}
+            except Exception as e:
+                results[i] = {"index": i, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    n_ok = sum(1 for r in results if r["ok"])
+    return {"count": len(results), "succeeded": n_ok, "failed": len(results) - n_ok, "results": results}
+
+def allowed_rows(b, q: str, filters: Optional[Dict[str, Any]]):
+    """
+    Row mask from structured filters AND the strong-term gate (when every term
+    has postings), or None if unconstrained. Filtering before the search keeps
+    the pool full instead of thinning a fixed overfetch.
+    """
+    gate = None
+    strong = strong_terms_from_query(q)
+    postings = b.keyword_postings
+    if strong and postings and all(t in postings for t in strong):
+        gate = postings_mask(postings, strong, len(b.meta))
+    return combine_masks([filter_mask(b, filters), gate])
+
+def _json_safe(v):
+    # NaN is not valid JSON; numpy scalars are unwrapped by to_dict already
+    return None if isinstance(v, float) and math.isnan(v) else v
+
+def rerank_and_build(b, q: str, topk: int, df: pd.DataFrame,
+                     deadline: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Keyword gate + duration boost over the candidate pool, then (if enabled)
+    the cross-encoder stage within its budget, then the JSON payload.
+    `deadline` (perf_counter) bounds the cross-encoder; None = its budget from now.
+    """
+    n = max(topk, cross_encoder.top_n) if cross_encoder is not None else topk
+    df = rerank_candidates(b.rerank_arrays, q, df, n, postings=b.keyword_postings)
+    reranker = None
+    if cross_encoder is not None:
+        df, applied = cross_encoder.rerank(q, df, topk, deadline)
+        reranker = "cross-encoder" if applied else "bi-encoder"
 
     # ---------- Build safe JSON
+    with span("build"):
+        out = _build_response(q, df)
+    if reranker is not None:
+        out["reranker"] = reranker
+    return out
+
+def _cacheable(b, out: Dict[str, Any]) -> bool:
+    # not results of a replaced bundle, nor a budget fallback (the next try may fit)
+    return b.version == result_cache.version and out.get("reranker") != "bi-encoder"
+
+def _build_response(q: str, df: pd.DataFrame) -> Dict[str, Any]:
     recs: List[Dict[str, Any]] = []
-    for _, r in df.iterrows():
+    for r in df.to_dict("records"):
         recs.append({
-            "assessment_name": r.get("title", ""),
-            "assessment_url":  r.get("url", ""),
-            "test_type":       r.get("test_type", None),
-            "level":           r.get("level", None),
-            "language":        r.get("language", None),
-            "duration_min":    r.get("duration_min", None),
-            "similarity":      r.get("similarity", None),
-            "description":     r.get("description", None),
+            "assessment_name": _json_safe(r.get("title", "")),
+            "assessment_url":  _json_safe(r.get("url", "")),
+            "test_type":       _json_safe(r.get("test_type", None)),
+            "level":           _json_safe(r.get("level", None)),
+            "language":        _json_safe(r.get("language", None)),
+            "duration_min":    _json_safe(r.get("duration_min", None)),
+            "similarity":      _json_safe(r.get("similarity", None)),
+            "description":     _json_safe(r.get("description", None)),
         })
 
     return {"query": q, "count": len(recs), "recommendations": recs}
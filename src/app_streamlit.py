@@ -24,12 +24,12 @@ st.set_page_config(
 )
 
 # ---------- Constants (must match your index build) ----------
-MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"  # <- keep in sync with indexer/evaluate/api
+MODEL_NAME = None  # None = the model recorded in index/manifest.json by the indexer
 INDEX_DIR = "index"  # relative to project root
 
 # ---------- Cached loader ----------
 @st.cache_resource(show_spinner=True)
-def get_bundle(model_name: str):
+def get_bundle(model_name):
     return load_index(INDEX_DIR, model_name=model_name)
 
 # ---------- Sidebar ----------
@@ -42,7 +42,7 @@ st.sidebar.write(
 
 try:
     bundle = get_bundle(MODEL_NAME)
-    st.sidebar.success("Index loaded ✅")
+    st.sidebar.success(f"Index loaded ✅ ({bundle.model_name})")
 except Exception as e:
     st.sidebar.error(f"Failed to load index:\n\n{e}")
     st.stop()
@@ -116,8 +116,7 @@ if st.button("Recommend", type="primary"):
             st.error(
                 "Embedding dimension mismatch: your app and FAISS index are using different models.\n\n"
                 "Fix:\n"
-                "1) Ensure MODEL_NAME here is "
-                "`sentence-transformers/all-mpnet-base-v2` (matches the index).\n"
+                "1) Leave MODEL_NAME here as None so the model comes from index/manifest.json.\n"
                 "2) Rebuild index if needed.\n"
                 "3) Clear Streamlit cache then rerun:  `streamlit cache clear`"
             )
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Async micro-batcher: coalesces concurrent single-query searches into one
+batched encode + FAISS search, then fans results back out to the callers.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from src.metrics import merge_timings, record, run_with_timings
+except ModuleNotFoundError:
+    from metrics import merge_timings, record, run_with_timings  # type: ignore
+
+# (bundle, queries, topks, allow=row masks) -> list of per-query result frames
+BatchFn = Callable[..., List[pd.DataFrame]]
+
+class MicroBatcher:
+    """
+    A batch is flushed when it reaches `max_batch_size` items or `max_wait_ms`
+    after its first item arrived, whichever comes first. Batches run one at a
+    time in a worker thread; requests arriving meanwhile form the next batch.
+    """
+    def __init__(self, run_batch: BatchFn, max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 executor: Optional[Executor] = None):
+        self.run_batch = run_batch
+        self.executor = executor   # None = the loop's default executor
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._worker(), name="micro-batcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, bundle: Any, query: str, topk: int,
+                     allow: Optional[np.ndarray] = None) -> pd.DataFrame:
+        if self._task is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        await self._queue.put((bundle, query, topk, fut, allow, loop.time()))
+        frame, timings, waited = await fut
+        record("batch_wait", waited)
+        merge_timings(timings)   # the shared batch's stage times, seen by every member
+        return frame
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": (self.items / self.batches) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+    async def _collect(self) -> List[Tuple]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._collect()
+            # requests that captured different bundles (e.g. across a reload)
+            # are searched against the bundle they started with
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[0]), []).append(item)
+            for items in groups.values():
+                live = [it for it in items if not it[3].done()]   # skip cancelled callers
+                if not live:
+                    continue
+                self.batches += 1
+                self.items += len(live)
+                started = asyncio.get_running_loop().time()
+                try:
+                    frames, timings = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, functools.partial(
+                            run_with_timings, self.run_batch,
+                            live[0][0], [it[1] for it in live], [it[2] for it in live],
+                            allow=[it[4] for it in live],
+                        ),
+                    )
+                except Exception as e:
+                    for it in live:
+                        if not it[3].done():
+                            it[3].set_exception(e)
+                    continue
+                for it, frame in zip(live, frames):
+                    if not it[3].done():
+                        it[3].set_result((frame, timings, started - it[5]))
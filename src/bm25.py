@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Array-backed BM25 index over the indexer's `build_doc` text.
+
+Postings are stored CSR-style (indptr / doc ids / precomputed BM25 impacts),
+so a query is a handful of fancy-indexed adds into one score vector.
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+[+#]*")   # keeps "c++" / "c#" apart from "c"
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall((text or "").lower())
+
+class BM25Index:
+    def __init__(self, vocab: Dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray,
+                 impacts: np.ndarray, n_docs: int):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.n_docs = int(n_docs)
+
+    @classmethod
+    def build(cls, docs: List[str], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        return BM25Builder().add(docs).finish(k1, b)
+
+    def save(self, path: str) -> None:
+        terms = np.array(sorted(self.vocab, key=self.vocab.get))
+        np.savez(path, terms=terms, indptr=self.indptr, doc_ids=self.doc_ids,
+                 impacts=self.impacts, n_docs=np.int64(self.n_docs))
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as z:
+            vocab = {str(t): i for i, t in enumerate(z["terms"])}
+            return cls(vocab, z["indptr"], z["doc_ids"], z["impacts"], int(z["n_docs"]))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for `query` (float32, length n_docs)."""
+        out = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t_id = self.vocab.get(term)
+            if t_id is None:
+                continue
+            s, e = self.indptr[t_id], self.indptr[t_id + 1]
+            # doc ids are unique within one posting list, so += is safe
+            out[self.doc_ids[s:e]] += self.impacts[s:e]
+        return out
+
+    def search(self, query: str, topk: int,
+               allow: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (scores, ids) of the top-k documents with a positive score, best first,
+        restricted to rows where the bool mask `allow` is set.
+        """
+        sc = self.scores(query)
+        if allow is not None:
+            sc[~allow] = 0.0
+        hits = np.flatnonzero(sc > 0)
+        if len(hits) > topk:
+            hits = hits[np.argpartition(-sc[hits], topk - 1)[:topk]]
+        hits = hits[np.argsort(-sc[hits], kind="stable")]
+        return sc[hits], hits
+
+class BM25Builder:
+    """
+    Incremental BM25Index construction: `add` docs in chunks (ids continue
+    across calls), `finish` once. Holds only the postings and doc lengths,
+    never the doc texts; gives the same index as BM25Index.build on all docs.
+    """
+    def __init__(self):
+        self.n_docs = 0
+        self.dl: List[np.ndarray] = []
+        self.postings: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+
+    def add(self, docs: List[str]) -> "BM25Builder":
+        counts = [Counter(tokenize(d)) for d in docs]
+        chunk: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, c in enumerate(counts, start=self.n_docs):
+            for term, tf in c.items():
+                ids, tfs = chunk.setdefault(term, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        for term, (ids, tfs) in chunk.items():
+            self.postings.setdefault(term, []).append(
+                (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.int32)))
+        self.dl.append(np.array([sum(c.values()) for c in counts], dtype=np.float64))
+        self.n_docs += len(docs)
+        return self
+
+    def finish(self, k1: float = 1.2, b: float = 0.75) -> BM25Index:
+        dl = np.concatenate(self.dl) if self.dl else np.zeros(0)
+        avgdl = dl.mean() if len(dl) and dl.mean() > 0 else 1.0
+
+        terms = sorted(self.postings)
+        n = self.n_docs
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, impacts = [], []
+        for t_id, term in enumerate(terms):
+            parts = self.postings[term]
+            ids = np.concatenate([p[0] for p in parts])
+            tf = np.concatenate([p[1] for p in parts]).astype(np.float64)
+            idf = np.log(1.0 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = tf + k1 * (1.0 - b + b * dl[ids] / avgdl)
+            doc_ids.append(ids)
+            impacts.append((idf * tf * (k1 + 1.0) / norm).astype(np.float32))
+            indptr[t_id + 1] = indptr[t_id] + len(ids)
+
+        return BM25Index(
+            vocab={t: i for i, t in enumerate(terms)},
+            indptr=indptr,
+            doc_ids=np.concatenate(doc_ids) if doc_ids else np.zeros(0, np.int32),
+            impacts=np.concatenate(impacts) if impacts else np.zeros(0, np.float32),
+            n_docs=n,
+        )
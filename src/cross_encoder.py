@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Optional cross-encoder second stage for /recommend.
+
+The bi-encoder pool is first gated and duration-ranked as usual
+(rerank.rerank_candidates); the top-N of that order are then scored as
+(query, assessment) pairs in one batched forward pass and re-sorted on
+0.85 * cross score + 0.15 * duration fit (single-label cross-encoders
+already return sigmoid probabilities from predict()).
+
+The stage has a strict latency budget. The cost of the forward pass is
+predicted as a fixed per-call overhead plus an EWMA of observed seconds per
+pair (both calibrated by `warm`); if the prediction does not fit in the time
+left before the request's deadline, the stage is skipped and the bi-encoder
+order is returned unchanged. Pair scores are cached per
+(normalized query, assessment_id), so repeats and overlapping pools only pay
+for the pairs they have not seen.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from src.metrics import span
+    from src.retriever import LRUCache, normalize_query
+except ModuleNotFoundError:
+    from metrics import span  # type: ignore
+    from retriever import LRUCache, normalize_query  # type: ignore
+
+EWMA_ALPHA = 0.2
+SAFETY = 1.25   # estimate * SAFETY must fit in the remaining budget
+
+def _query_hash(q: str) -> str:
+    return hashlib.blake2b(normalize_query(q).encode(), digest_size=8).hexdigest()
+
+def passage(row: Dict[str, Any]) -> str:
+    """Candidate text fed to the cross-encoder (title first: it survives truncation)."""
+    parts = [row.get("title"), row.get("test_type"), row.get("level"), row.get("description")]
+    return ". ".join(str(p) for p in parts if isinstance(p, str) and p.strip())
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str, top_n: int = 20, budget_ms: float = 150.0,
+                 max_length: int = 256, cache_size: int = 50000, cache_ttl: Optional[float] = None):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.top_n = int(top_n)
+        self.budget = float(budget_ms) / 1000.0
+        self.pair_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.sec_per_pair: Optional[float] = None   # EWMA; None until the first pass
+        self.sec_per_call = 0.0   # fixed overhead of one predict() (tokenizer setup, dispatch)
+        self._lock = threading.Lock()
+        self.counts = {"scored": 0, "cached": 0, "skipped_budget": 0, "overrun": 0}
+
+    # ---------- cost model
+    def estimate(self, n_pairs: int) -> float:
+        if n_pairs == 0:
+            return 0.0
+        if self.sec_per_pair is None:
+            return float("inf")   # uncalibrated: never gamble the budget (see warm)
+        return (self.sec_per_call + self.sec_per_pair * n_pairs) * SAFETY
+
+    def _observe(self, seconds: float, n_pairs: int) -> None:
+        # the overhead is known from warm(); the rest of the call is charged per pair
+        per = max(0.0, seconds - self.sec_per_call) / max(1, n_pairs)
+        with self._lock:
+            self.sec_per_pair = per if self.sec_per_pair is None else (
+                EWMA_ALPHA * per + (1.0 - EWMA_ALPHA) * self.sec_per_pair)
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def _timed_predict(self, pairs) -> float:
+        t0 = time.perf_counter()
+        self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return time.perf_counter() - t0
+
+    def warm(self, q: str, df: pd.DataFrame) -> None:
+        """
+        Calibrate the cost model on a real pool of up to top_n pairs (ignores the
+        budget, bypasses the cache): one pair and the full pool are timed, which
+        separates the per-call overhead from the per-pair cost.
+        """
+        pairs = [(q, passage(r)) for r in df.head(self.top_n).to_dict("records")]
+        if not pairs:
+            return
+        self._timed_predict(pairs)   # first calls pay one-off allocation; not representative
+        one, full = self._timed_predict(pairs[:1]), self._timed_predict(pairs)
+        if len(pairs) > 1:
+            per = max(0.0, (full - one) / (len(pairs) - 1))
+            call = max(0.0, one - per)
+        else:
+            per, call = full, 0.0
+        with self._lock:
+            if self.sec_per_pair is None:
+                self.sec_per_pair, self.sec_per_call = per, call
+            else:
+                self.sec_per_pair = EWMA_ALPHA * per + (1.0 - EWMA_ALPHA) * self.sec_per_pair
+                self.sec_per_call = EWMA_ALPHA * call + (1.0 - EWMA_ALPHA) * self.sec_per_call
+
+    # ---------- rerank
+    def _pair_key(self, qh: str, row: Dict[str, Any]) -> Tuple[str, str]:
+        return (qh, str(row.get("assessment_id") or row.get("url") or ""))
+
+    def rerank(self, q: str, df: pd.DataFrame, topk: int,
+               deadline: Optional[float] = None) -> Tuple[pd.DataFrame, bool]:
+        """
+        `df` is the output of rerank_candidates (final bi-encoder order, with
+        `_dur_score`). Returns (top-k frame, True) when cross-encoder scores
+        were applied, or (df[:topk], False) when the budget did not allow it.
+        `deadline` is a time.perf_counter() value; None = budget from now.
+        """
+        head = df.head(max(self.top_n, topk))
+        if head.empty:
+            return df.head(topk), False
+        records = head.to_dict("records")
+        qh = _query_hash(q)
+        keys = [self._pair_key(qh, r) for r in records]
+        cached = [self.pair_cache.get(k) for k in keys]
+        scores = np.array([np.nan if s is None else s for s in cached], dtype=np.float64)
+        todo = np.flatnonzero(np.isnan(scores))
+
+        if len(todo):
+            remaining = (deadline if deadline is not None else time.perf_counter() + self.budget) \
+                - time.perf_counter()
+            if self.estimate(len(todo)) > remaining:
+                self._count("skipped_budget")
+                return df.head(topk), False
+            with span("cross_encode"):
+                t0 = time.perf_counter()
+                pred = self.model.predict([(q, passage(records[i])) for i in todo],
+                                          batch_size=len(todo), show_progress_bar=False)
+                took = time.perf_counter() - t0
+            self._observe(took, len(todo))
+            if took > remaining:
+                self._count("overrun")
+            for i, s in zip(todo, np.asarray(pred, dtype=np.float64).reshape(-1)):
+                scores[i] = s
+                self.pair_cache.put(keys[i], float(s))
+            self._count("scored")
+        else:
+            self._count("cached")
+
+        final = 0.85 * scores + 0.15 * head["_dur_score"].to_numpy(dtype=np.float64)
+        idx = np.argsort(-final, kind="stable")[:topk]
+        out = head.iloc[idx].copy()
+        out["cross_score"] = scores[idx]
+        out["_final"] = final[idx]
+        return out, True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "top_n": self.top_n,
+                "budget_ms": self.budget * 1000.0,
+                "ms_per_pair": None if self.sec_per_pair is None else self.sec_per_pair * 1000.0,
+                "ms_per_call": self.sec_per_call * 1000.0,
+                **self.counts,
+                "pair_cache": self.pair_cache.stats(),
+            }
@@ -3,7 +3,7 @@ import argparse, re
 import pandas as pd
 from collections import defaultdict
 from urllib.parse import urlparse
-from retriever import load_index, search
+from retriever import load_index, search_many
 
 def norm(u: str) -> str:
     if not isinstance(u, str): return ""
@@ -19,7 +19,7 @@ def recall_at_k(pred_urls, true_urls, k=10):
     denom = max(1, len(T))
     return hits / denom
 
-def main(train_tidy: str, indexdir: str, model_name: str, k: int = 10):
+def main(train_tidy: str, indexdir: str, model_name: str = None, k: int = 10, retrieval: str = "dense"):
     df = pd.read_csv(train_tidy)
     if not {"query","relevant_url"}.issubset(df.columns):
         raise SystemExit("Train tidy must have columns: query, relevant_url")
@@ -31,11 +31,14 @@ def main(train_tidy: str, indexdir: str, model_name: str, k: int = 10):
         if q and u:
             truth[q].append(u)
 
-    bundle = load_index(indexdir, model_name=model_name)
+    bundle = load_index(indexdir, model_name=model_name, retrieval=retrieval)
+
+    queries = list(truth.keys())
+    all_preds = search_many(bundle, queries, topk=10)
 
     rows = []
-    for q, urls in truth.items():
-        preds = search(bundle, q, topk=10)
+    for q, preds in zip(queries, all_preds):
+        urls = truth[q]
         r = recall_at_k(preds["url"].tolist(), urls, k=k)
         rows.append({"query": q, "n_truth": len(urls), "recall_at_10": r})
 
@@ -47,7 +50,9 @@ if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--train", required=True, help="data/train_tidy_query_url.csv")
     ap.add_argument("--indexdir", default="index", help="Directory with faiss.index, vectors.npy, meta.parquet")
-    ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2", help="Encoder model (must match index)")
+    ap.add_argument("--model", default=None, help="Encoder model (default: the one in the index manifest)")
     ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--retrieval", default="dense", choices=["dense", "hybrid"],
+                    help="hybrid = BM25 + dense with reciprocal-rank fusion")
     args = ap.parse_args()
-    main(args.train, args.indexdir, args.model, args.k)
+    main(args.train, args.indexdir, args.model, args.k, args.retrieval)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Precomputed attribute index for structured filters (test_type, level,
+language, duration_min). Built by indexer.py into attributes.npz and turned
+into a row mask that retriever.search pushes into FAISS as an ID selector.
+"""
+import re
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+CATEGORICAL = ("test_type", "level", "language")
+
+def _norm(v: Any) -> str:
+    return str(v).strip().casefold()
+
+def _split_values(v: Any):
+    """Multi-valued cells ("A, K") index under each value."""
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return []
+    return [_norm(p) for p in re.split(r"[,;/|]", str(v)) if p.strip()]
+
+def _as_list(v) -> list:
+    if v is None:
+        return []
+    return [v] if isinstance(v, str) else list(v)
+
+class AttributeIndex:
+    """
+    bitmaps:  attr -> value -> packed row bitset (little bit order)
+    duration: row ids with a numeric duration_min, sorted by that duration,
+              plus the sorted durations, so a range is two searchsorted calls.
+    """
+    def __init__(self, n: int, bitmaps: Dict[str, Dict[str, np.ndarray]],
+                 dur_order: np.ndarray, dur_sorted: np.ndarray):
+        self.n = int(n)
+        self.bitmaps = bitmaps
+        self.dur_order = dur_order
+        self.dur_sorted = dur_sorted
+
+    @classmethod
+    def build(cls, meta: pd.DataFrame) -> "AttributeIndex":
+        n = len(meta)
+        bitmaps: Dict[str, Dict[str, np.ndarray]] = {}
+        for attr in CATEGORICAL:
+            rows_by_value: Dict[str, list] = {}
+            values = meta[attr].tolist() if attr in meta.columns else []
+            for i, v in enumerate(values):
+                for val in _split_values(v):
+                    rows_by_value.setdefault(val, []).append(i)
+            bitmaps[attr] = {}
+            for val, rows in rows_by_value.items():
+                hit = np.zeros(n, dtype=bool)
+                hit[rows] = True
+                bitmaps[attr][val] = np.packbits(hit, bitorder="little")
+
+        dur = pd.to_numeric(meta["duration_min"], errors="coerce").to_numpy(dtype=np.float64) \
+            if "duration_min" in meta.columns else np.full(n, np.nan)
+        valid = np.flatnonzero(~np.isnan(dur))
+        order = valid[np.argsort(dur[valid], kind="stable")]
+        return cls(n, bitmaps, order.astype(np.int64), dur[order])
+
+    def save(self, path: str) -> None:
+        arrays = {"n": np.int64(self.n), "dur_order": self.dur_order, "dur_sorted": self.dur_sorted}
+        for attr, by_value in self.bitmaps.items():
+            vals = sorted(by_value)
+            arrays[f"{attr}__values"] = np.array(vals, dtype=str)
+            arrays[f"{attr}__bits"] = (np.stack([by_value[v] for v in vals]) if vals
+                                       else np.zeros((0, (self.n + 7) // 8), np.uint8))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "AttributeIndex":
+        with np.load(path) as z:
+            bitmaps = {}
+            for attr in CATEGORICAL:
+                if f"{attr}__values" in z:
+                    bitmaps[attr] = {str(v): b for v, b in zip(z[f"{attr}__values"], z[f"{attr}__bits"])}
+            return cls(int(z["n"]), bitmaps, z["dur_order"], z["dur_sorted"])
+
+    def mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Row mask for `filters`, or None when nothing is constrained.
+          {"test_type": "K" | ["K", "P"], "level": ..., "language": ...,
+           "min_duration": 10, "max_duration": 40}
+        Values within one attribute are OR-ed; attributes are AND-ed.
+        """
+        if not filters:
+            return None
+        packed = None
+        for attr in CATEGORICAL:
+            wanted = [_norm(v) for v in _as_list(filters.get(attr))]
+            if not wanted:
+                continue
+            acc = np.zeros((self.n + 7) // 8, dtype=np.uint8)
+            for val in wanted:
+                bits = self.bitmaps.get(attr, {}).get(val)
+                if bits is not None:
+                    acc |= bits
+            packed = acc if packed is None else (packed & acc)
+
+        mask = None if packed is None else \
+            np.unpackbits(packed, count=self.n, bitorder="little").astype(bool)
+
+        lo, hi = filters.get("min_duration"), filters.get("max_duration")
+        if lo is not None or hi is not None:
+            a = 0 if lo is None else np.searchsorted(self.dur_sorted, float(lo), side="left")
+            b = len(self.dur_sorted) if hi is None else np.searchsorted(self.dur_sorted, float(hi), side="right")
+            dmask = np.zeros(self.n, dtype=bool)
+            dmask[self.dur_order[a:b]] = True
+            mask = dmask if mask is None else (mask & dmask)
+        return mask
+
+def combine_masks(masks: Iterable[Optional[np.ndarray]]) -> Optional[np.ndarray]:
+    """AND of the non-None masks (None if all are None)."""
+    out = None
+    for m in masks:
+        if m is not None:
+            out = m.copy() if out is None else (out & m)
+    return out
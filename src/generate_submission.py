@@ -4,11 +4,11 @@ import pandas as pd
 
 # robust import whether run from repo root or src/
 try:
-    from src.retriever import load_index, search
+    from src.retriever import load_index, search_many
 except ModuleNotFoundError:
     import os, sys as _sys
     _sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-    from retriever import load_index, search  # type: ignore
+    from retriever import load_index, search_many  # type: ignore
 
 def main(indexdir, model_name, test_csv, out_csv, topk):
     # load index/model
@@ -25,9 +25,11 @@ def main(indexdir, model_name, test_csv, out_csv, topk):
         raise ValueError(f"Could not find a query column in {test_csv}. "
                          "Expected one of: query, queries, jd, job_description, text")
 
+    queries = df[qcol].astype(str).tolist()
+    results = search_many(bundle, queries, topk=topk)
+
     rows = []
-    for q in df[qcol].astype(str).tolist():
-        res = search(bundle, q, topk=topk)
+    for q, res in zip(queries, results):
         for url in res.get("url", []):
             rows.append({"Query": q, "Assessment_url": url})
 
@@ -38,7 +40,7 @@ def main(indexdir, model_name, test_csv, out_csv, topk):
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--indexdir", default="index")
-    ap.add_argument("--model", default="sentence-transformers/all-mpnet-base-v2")
+    ap.add_argument("--model", default=None, help="Encoder model (default: the one in the index manifest)")
     ap.add_argument("--test", default="data/test_queries.csv")
     ap.add_argument("--out", default="submission.csv")
     ap.add_argument("--topk", type=int, default=10)
@@ -7,14 +7,45 @@ Usage:
     --model sentence-transformers/all-MiniLM-L6-v2
   # Tip: for better quality try:
   # --model sentence-transformers/all-mpnet-base-v2
+  # Encode with onnxruntime instead of torch (CPU):
+  # --backend onnx   (or onnx-int8)
+  # Versioned output (index/versions/<timestamp>/ + atomic index/CURRENT switch,
+  # picked up by the API's hot reload without a restart):
+  # --versioned
+  # Approximate (sub-linear) index for large catalogs:
+  # --index-type hnsw|ivfflat|ivfpq  [--nlist 1024 --nprobe 16 --ef-search 128 ...]
+  # Large catalogs: encode on N processes (bit-identical to --workers 1 run
+  # with the same --threads; --verify checks that on the first N docs):
+  # --workers 4 [--threads 2 --verify 2048]
+  # Catalogs that do not fit in memory (CSV or .parquet), chunk by chunk
+  # (ivfpq index by default; flat / hnsw would hold every vector in RAM):
+  # --stream [--read-chunk 50000]
+  # Every build writes manifest.json (model, dim, rows, checksums); the API,
+  # evaluate.py and the Streamlit app take the model from it. For an index dir
+  # built before manifests existed:
+  # python src/indexer.py --manifest-only --outdir index --model <model it was built with>
 """
 import argparse
+import json
+import math
+import os
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
 import faiss
 
+from retriever import (BACKENDS, CURRENT_FILE, INDEX_FILES, MANIFEST_FILE, MANIFEST_FORMAT,
+                       detect_index_type, load_model, model_revision, quick_checksum, set_thread_budget)
+from bm25 import BM25Builder, BM25Index
+from filters import AttributeIndex
+from rerank import build_keyword_postings, precompute_rerank_arrays
+
 DOC_TEMPLATE = (
     "Assessment Name: {title}. "
     "Category: {category}. "
@@ -49,14 +80,307 @@ def build_doc(row):
         description=sg(row, "description"),
     )
 
-def main(catalog_path: str, outdir: str, model_name: str):
+# ----------------------------
+# Embedding (single or multi-process)
+# ----------------------------
+# Documents are always encoded in fixed chunks of ENCODE_CHUNK, whatever the
+# number of workers: SentenceTransformer sorts each call's input by length
+# before batching, so the chunking decides the batches (and their padding).
+# Same chunks + same thread count per forward pass = identical embeddings.
+ENCODE_CHUNK = 1024
+ENCODE_BATCH = 32
+
+def _encode_chunk(model, docs) -> np.ndarray:
+    X = model.encode(docs, normalize_embeddings=True, batch_size=ENCODE_BATCH, show_progress_bar=False)
+    return np.asarray(X, dtype=np.float32)
+
+_worker_model = None
+
+def _init_worker(model_name: str, backend: str, threads: int) -> None:
+    global _worker_model
+    set_thread_budget(torch_threads=threads)
+    _worker_model = load_model(model_name, backend, threads=threads)
+
+def _worker_encode(docs):
+    t0 = time.perf_counter()
+    X = _encode_chunk(_worker_model, docs)
+    return os.getpid(), len(docs), time.perf_counter() - t0, X, model_revision(_worker_model)
+
+def _chunks(docs, size: int):
+    return [docs[s:s + size] for s in range(0, len(docs), size)]
+
+class DocEncoder:
+    """
+    Encodes documents in ENCODE_CHUNK chunks, either in this process or on a
+    spawn pool of `workers` processes (each loads the model once and uses
+    `threads` torch threads, default cpu_count // workers). Chunks come back
+    in order. Reusable across calls, so the streaming build keeps one pool.
+    """
+    def __init__(self, model_name: str, backend: str = "torch", workers: int = 1,
+                 threads: int = None, total: int = None):
+        self.workers = max(1, int(workers or 1))
+        self.threads = threads or (max(1, (os.cpu_count() or 1) // self.workers) if self.workers > 1 else None)
+        self.total = total
+        self.done = 0
+        self.revision = None
+        self.model, self.pool = None, None
+        self.per_worker = defaultdict(lambda: [0, 0.0])   # pid -> [docs, busy seconds]
+        self.t0 = time.perf_counter()
+        if self.workers == 1:
+            set_thread_budget(torch_threads=self.threads)
+            self.model = load_model(model_name, backend, threads=self.threads)
+            self.revision = model_revision(self.model)
+        else:
+            print(f"[INFO] Encoding with {self.workers} workers x {self.threads} threads "
+                  f"(chunks of {ENCODE_CHUNK})")
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                            initializer=_init_worker, initargs=(model_name, backend, self.threads))
+
+    def _progress(self, n: int) -> None:
+        self.done += n
+        of = f"/{self.total}" if self.total else ""
+        print(f"[INFO] Encoded {self.done}{of} docs "
+              f"({self.done / max(1e-9, time.perf_counter() - self.t0):.1f} docs/s)")
+
+    def encode(self, docs) -> np.ndarray:
+        """(len(docs), d) float32 normalized embeddings, in input order."""
+        chunks = _chunks(list(docs), ENCODE_CHUNK)
+        if self.model is not None:
+            parts = []
+            for chunk in chunks:
+                parts.append(_encode_chunk(self.model, chunk))
+                self._progress(len(chunk))
+            return np.vstack(parts) if parts else np.zeros((0, 0), np.float32)
+
+        X, at = None, 0
+        # map() yields in submission order while later chunks are still encoding
+        for pid, n, secs, part, rev in self.pool.map(_worker_encode, chunks):
+            if X is None:
+                X = np.empty((len(docs), part.shape[1]), dtype=np.float32)
+            X[at:at + n] = part
+            at += n
+            self.revision = self.revision or rev
+            self.per_worker[pid][0] += n
+            self.per_worker[pid][1] += secs
+            self._progress(n)
+        return X if X is not None else np.zeros((0, 0), np.float32)
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            for pid, (n, secs) in sorted(self.per_worker.items()):
+                print(f"[WORKER] pid={pid} docs={n} busy={secs:.1f}s ({n / max(1e-9, secs):.1f} docs/s)")
+        print(f"[INFO] Encoded {self.done} docs in {time.perf_counter() - self.t0:.1f}s")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def encode_docs(docs, model_name: str, backend: str = "torch", workers: int = 1, threads: int = None):
+    """(n, d) float32 normalized embeddings of `docs` and the model revision (see DocEncoder)."""
+    with DocEncoder(model_name, backend, workers, threads, total=len(docs)) as enc:
+        X = enc.encode(docs)
+    return X, enc.revision
+
+def verify_embeddings(X: np.ndarray, docs, model_name: str, backend: str, threads: int, n: int) -> None:
+    """Re-encode the first ~n docs in this process (same chunks/threads) and require equal bits."""
+    threads = threads or 1
+    set_thread_budget(torch_threads=threads)
+    model = load_model(model_name, backend, threads=threads)
+    m = min(len(docs), ENCODE_CHUNK * max(1, -(-n // ENCODE_CHUNK)))
+    ref = np.vstack([_encode_chunk(model, c) for c in _chunks(docs[:m], ENCODE_CHUNK)])
+    if not np.array_equal(ref, X[:m]):
+        diff = float(np.abs(ref - X[:m]).max())
+        raise SystemExit(f"[ERROR] --verify: multi-process embeddings differ from single-process "
+                         f"(max abs diff {diff:.3g} over {m} docs)")
+    print(f"[DONE] --verify: first {m} embeddings are bit-identical to single-process")
+
+INDEX_TYPES = ("flat", "hnsw", "ivfflat", "ivfpq")
+PARAMS_FILE = "index_params.json"
+KEYWORDS_FILE = "keywords.npz"
+BM25_FILE = "bm25.npz"
+ATTRIBUTES_FILE = "attributes.npz"
+
+TRAIN_PER_CENTROID = 39   # FAISS's own minimum training points per k-means centroid
+
+def default_index_params(index_type: str, n: int, d: int) -> dict:
+    """
+    Build + search parameters for `index_type` sized for n vectors of dim d.
+    IVF: nlist ~ 4*sqrt(n), but never more than n // TRAIN_PER_CENTROID, so
+    k-means gets enough points per centroid (the sqrt rule alone over-splits
+    catalogs below ~24k rows). IVF-PQ codebooks follow the same rule: 8 bits
+    from ~10k rows, fewer (down to 4) below. Catalogs of a few thousand rows
+    are better served by flat, which is exact and still fast at that size.
+    """
+    if index_type == "flat":
+        return {"type": "flat"}
+    if index_type == "hnsw":
+        return {"type": "hnsw", "M": 32, "efConstruction": 200, "efSearch": 128}
+    nlist = max(1, min(n, int(4 * math.sqrt(n)), n // TRAIN_PER_CENTROID))
+    params = {"type": index_type, "nlist": nlist, "nprobe": min(nlist, 16)}
+    if index_type == "ivfpq":
+        pq_m = next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if d % m == 0)
+        per_code = max(1, n // TRAIN_PER_CENTROID)
+        params.update(pq_m=pq_m, pq_nbits=min(8, max(4, per_code.bit_length() - 1)))
+    return params
+
+def new_faiss_index(d: int, params: dict) -> faiss.Index:
+    """Empty inner-product index (cosine on normalized vectors) of params["type"]."""
+    kind = params["type"]
+    if kind == "flat":
+        return faiss.IndexFlatIP(d)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, int(params["M"]), faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = int(params["efConstruction"])
+        index.hnsw.efSearch = int(params["efSearch"])
+        return index
+    if kind in ("ivfflat", "ivfpq"):
+        nlist = int(params["nlist"])
+        quantizer = faiss.IndexFlatIP(d)
+        if kind == "ivfflat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            m, nbits = int(params["pq_m"]), int(params["pq_nbits"])
+            if d % m:
+                raise SystemExit(f"ivfpq: pq_m={m} must divide dim={d}")
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = int(params["nprobe"])
+        return index
+    raise SystemExit(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+
+def train_faiss_index(index: faiss.Index, X: np.ndarray, params: dict) -> None:
+    """Train IVF variants on X (no-op for flat / HNSW)."""
+    kind = params["type"]
+    if kind not in ("ivfflat", "ivfpq"):
+        return
+    n, nlist = len(X), int(params["nlist"])
+    if n < nlist:
+        raise SystemExit(f"{kind}: need at least nlist={nlist} vectors to train, got {n}")
+    if kind == "ivfpq" and n < (1 << int(params["pq_nbits"])):
+        raise SystemExit(f"ivfpq: need at least {1 << int(params['pq_nbits'])} vectors to train "
+                         f"{params['pq_nbits']}-bit PQ, got {n}")
+    print(f"[INFO] Training {kind} (nlist={nlist}) on {n} vectors ...")
+    index.train(X)
+
+def build_faiss_index(X: np.ndarray, params: dict) -> faiss.Index:
+    """
+    Build an inner-product index (cosine on normalized vectors) of params["type"].
+    IVF variants are trained on X before adding.
+    """
+    index = new_faiss_index(X.shape[1], params)
+    train_faiss_index(index, X, params)
+    index.add(X)
+    return index
+
+def write_manifest(out: Path, model_name: str, params: dict, rows: int, dim: int,
+                   backend: str = "torch", revision: str = None) -> dict:
+    """manifest.json: what load_index needs to pick the model and validate the artifacts."""
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "model": {"name": model_name, "revision": revision, "backend": backend,
+                  "dim": int(dim), "normalize": True},
+        "index": {"metric": "inner_product", **params},
+        "rows": int(rows),
+        "files": {name: {"bytes": (out / name).stat().st_size, "checksum": quick_checksum(out / name)}
+                  for name in INDEX_FILES if (out / name).exists()},
+    }
+    tmp = out / f".{MANIFEST_FILE}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, out / MANIFEST_FILE)
+    return manifest
+
+def manifest_only(outdir: str, model_name: str) -> None:
+    """Write a manifest for an existing index dir (dim/rows/type read from faiss.index)."""
     out = Path(outdir)
-    out.mkdir(parents=True, exist_ok=True)
+    index = faiss.read_index(str(out / "faiss.index"))
+    params_path = out / PARAMS_FILE
+    params = json.loads(params_path.read_text()) if params_path.exists() else {"type": detect_index_type(index)}
+    write_manifest(out, model_name, params, index.ntotal, index.d)
+    print(f"[DONE] Wrote {out / MANIFEST_FILE} ({model_name}, d={index.d}, n={index.ntotal})")
 
-    df = pd.read_csv(catalog_path)
-    if df.empty:
-        raise SystemExit(f"Catalog is empty: {catalog_path}")
+def new_version_dir(root: str) -> Path:
+    """<root>/versions/<timestamp>-<pid>[-<n>]: unique even for builds in the same second."""
+    base = Path(root) / "versions" / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    base.parent.mkdir(parents=True, exist_ok=True)
+    for n in range(100):
+        d = base.with_name(f"{base.name}-{n}") if n else base
+        try:
+            d.mkdir()
+            return d
+        except FileExistsError:
+            continue
+    raise SystemExit(f"Could not create a new version dir under {base.parent}")
+
+def publish_version(root: str, version_dir: Path) -> None:
+    """Atomically point <root>/CURRENT at version_dir (readers see old or new, never half)."""
+    rel = version_dir.relative_to(Path(root)).as_posix()
+    tmp = Path(root) / f".{CURRENT_FILE}.tmp"
+    tmp.write_text(rel + "\n")
+    os.replace(tmp, Path(root) / CURRENT_FILE)
+    print(f"[DONE] {Path(root) / CURRENT_FILE} -> {rel}")
+
+# ----------------------------
+# Catalog input
+# ----------------------------
+def _is_parquet(path: str) -> bool:
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+def read_catalog(path: str) -> pd.DataFrame:
+    return pd.read_parquet(path) if _is_parquet(path) else pd.read_csv(path)
+
+def _merge_dtype(a, b):
+    """Column dtype pandas would infer over two chunks (int + float -> float, else object)."""
+    if a is None or a == b:
+        return b
+    if a.kind in "iuf" and b.kind in "iuf":
+        return np.result_type(a, b)
+    return np.dtype(object)
 
+def scan_catalog(path: str, chunksize: int = 100_000):
+    """
+    One bounded-memory pass over SAFE_COLS: (row count, {column: dtype}).
+    The dtypes are those of a whole-file read, so each chunk can be cast to
+    them and renders its doc text exactly like the in-memory build (a chunk
+    without missing durations would otherwise print "30", not "30.0").
+    """
+    n, dtypes = 0, {}
+    for df in iter_catalog(path, chunksize, columns=SAFE_COLS):
+        n += len(df)
+        for c in df.columns:
+            dtypes[c] = _merge_dtype(dtypes.get(c), df[c].dtype)
+    return n, dtypes
+
+def _rechunk(frames, size: int):
+    """Re-buffer frames of any length into frames of exactly `size` rows (last one shorter)."""
+    buf, have = [], 0
+    for df in frames:
+        buf.append(df)
+        have += len(df)
+        while have >= size:
+            df = pd.concat(buf, ignore_index=True) if len(buf) > 1 else buf[0].reset_index(drop=True)
+            yield df.iloc[:size].reset_index(drop=True)
+            rest = df.iloc[size:]
+            buf, have = ([rest] if len(rest) else []), len(rest)
+    if have:
+        yield pd.concat(buf, ignore_index=True)
+
+def iter_catalog(path: str, chunksize: int, columns=None):
+    """The catalog in frames of exactly `chunksize` rows (Parquet batches stop at row groups)."""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        cols = [c for c in pf.schema_arrow.names if c in columns] if columns else None
+        frames = (batch.to_pandas() for batch in pf.iter_batches(batch_size=chunksize, columns=cols))
+    else:
+        usecols = (lambda c: c in columns) if columns else None
+        frames = pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+    yield from _rechunk(frames, chunksize)
+
+def prepare_catalog(df: pd.DataFrame) -> pd.DataFrame:
     # Ensure missing expected columns exist (fill with empty)
     for c in SAFE_COLS:
         if c not in df.columns:
@@ -64,29 +388,273 @@ def main(catalog_path: str, outdir: str, model_name: str):
 
     # Build document text
     df["doc"] = df.apply(build_doc, axis=1)
+    return df
+
+def finish_params(index_type: str, n: int, d: int, index_overrides: dict = None) -> dict:
+    params = default_index_params(index_type, n, d)
+    params.update({k: v for k, v in (index_overrides or {}).items() if k in params and v is not None})
+    return params
+
+def main(catalog_path: str, outdir: str, model_name: str, backend: str = "torch",
+         index_type: str = "flat", index_overrides: dict = None, versioned: bool = False,
+         workers: int = 1, threads: int = None, verify: int = 0,
+         stream: bool = False, read_chunk: int = 50_000):
+    # Never write into files the API may have memory-mapped (SHL_INDEX_MMAP):
+    # build in a fresh dir, then switch CURRENT or os.replace file by file.
+    if versioned:
+        out = new_version_dir(outdir)
+    else:
+        Path(outdir).mkdir(parents=True, exist_ok=True)
+        out = Path(outdir) / f".build-{os.getpid()}"
+        out.mkdir()
+    try:
+        build(catalog_path, out, model_name, backend, index_type, index_overrides,
+              workers, threads, verify, stream, read_chunk)
+    except BaseException:
+        shutil.rmtree(out, ignore_errors=True)
+        raise
+    if versioned:
+        publish_version(outdir, out)
+    else:
+        replace_artifacts(out, Path(outdir))
+
+def replace_artifacts(stage: Path, root: Path) -> None:
+    """
+    Move a finished build from `stage` into `root`, one os.replace per file and
+    manifest.json last. Readers with the old files open or mapped keep the old
+    inodes; the API's watcher reacts to the manifest, i.e. once all are in.
+    """
+    names = sorted(p.name for p in stage.iterdir() if p.name != MANIFEST_FILE)
+    for name in names + [MANIFEST_FILE]:
+        os.replace(stage / name, root / name)
+    stage.rmdir()
+    print(f"[DONE] Replaced {len(names) + 1} files in {root} (manifest last)")
+
+def build(catalog_path: str, out: Path, model_name: str, backend: str = "torch",
+          index_type: str = "flat", index_overrides: dict = None,
+          workers: int = 1, threads: int = None, verify: int = 0,
+          stream: bool = False, read_chunk: int = 50_000) -> None:
+    """Write every index artifact into the (new, empty) dir `out`, manifest last."""
+    if stream:
+        if verify:
+            print("[WARN] --verify is only supported without --stream; skipping it")
+        params, (n, d), revision = build_streaming(catalog_path, out, model_name, backend, index_type,
+                                                   index_overrides, read_chunk, workers, threads)
+        write_manifest(out, model_name, params, n, d, backend=backend,
+                       revision=revision if backend == "torch" else None)
+        print(f"[DONE] Saved {params['type']} index to {out} (n={n}, streamed)")
+        return
+
+    df = read_catalog(catalog_path)
+    if df.empty:
+        raise SystemExit(f"Catalog is empty: {catalog_path}")
+    df = prepare_catalog(df)
 
     # Embed
-    print(f"[INFO] Using model: {model_name}")
-    model = SentenceTransformer(model_name)
-    X = model.encode(df["doc"].tolist(), normalize_embeddings=True, show_progress_bar=True)
-    X = X.astype(np.float32)
+    print(f"[INFO] Using model: {model_name} (backend={backend})")
+    docs = df["doc"].tolist()
+    if verify and workers <= 1:
+        print("[WARN] --verify compares multi-process against single-process embeddings; "
+              "it does nothing with --workers 1")
+    X, revision = encode_docs(docs, model_name, backend, workers=workers, threads=threads)
+    if verify and workers > 1:
+        verify_embeddings(X, docs, model_name, backend, threads or max(1, (os.cpu_count() or 1) // workers),
+                          verify)
 
     # FAISS index (cosine via inner product on normalized vectors)
-    d = X.shape[1]
-    index = faiss.IndexFlatIP(d)
-    index.add(X)
+    params = finish_params(index_type, *X.shape, index_overrides)
+    index = build_faiss_index(X, params)
 
     # Save artifacts
     faiss.write_index(index, str(out / "faiss.index"))
+    (out / PARAMS_FILE).write_text(json.dumps(params, indent=2))
     np.save(str(out / "vectors.npy"), X)
     df[SAFE_COLS].to_parquet(str(out / "meta.parquet"), index=False)
-    print(f"[DONE] Saved index to {out} (n={len(df)})")
+
+    # Inverted keyword index for the strong-term gate (term -> row bitset)
+    blob = precompute_rerank_arrays(df[SAFE_COLS])["text_blob"]
+    postings = build_keyword_postings(blob)
+    np.savez(str(out / KEYWORDS_FILE), n=np.int64(len(df)), terms=np.array(list(postings)),
+             bits=np.stack(list(postings.values())))
+
+    # Sparse BM25 index over the same doc text (for hybrid retrieval)
+    BM25Index.build(df["doc"].tolist()).save(str(out / BM25_FILE))
+
+    # Attribute bitmaps / sorted durations for filtered search
+    AttributeIndex.build(df[SAFE_COLS]).save(str(out / ATTRIBUTES_FILE))
+
+    # Written last: a dir with a manifest is complete
+    write_manifest(out, model_name, params, *X.shape, backend=backend,
+                   revision=revision if backend == "torch" else None)
+    print(f"[DONE] Saved {params['type']} index to {out} (n={len(df)})")
+
+# ----------------------------
+# Streaming build (bounded memory)
+# ----------------------------
+def _meta_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """SAFE_COLS with fixed dtypes, so every chunk matches one Parquet schema."""
+    out = pd.DataFrame(index=df.index)
+    for c in SAFE_COLS:
+        if c == "duration_min":
+            out[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+        else:
+            out[c] = df[c].map(lambda v: None if pd.isna(v) else str(v))
+    return out
+
+STREAM_INDEX_TYPES = ("ivfpq", "ivfflat")   # flat / HNSW hold every vector in RAM
+
+def train_sample(vectors: np.ndarray, params: dict, seed: int = 0) -> np.ndarray:
+    """
+    Rows of `vectors` (a memmap) to train an IVF index on: a uniform random
+    sample of TRAIN_PER_CENTROID * nlist rows (or all of them), read in row
+    order. Uniform, because a catalog sorted by vendor or category makes its
+    head a biased sample.
+    """
+    n = len(vectors)
+    m = TRAIN_PER_CENTROID * int(params["nlist"])
+    if params["type"] == "ivfpq":
+        m = max(m, 1 << int(params["pq_nbits"]))
+    if m >= n:
+        return np.ascontiguousarray(vectors[:])
+    rows = np.sort(np.random.default_rng(seed).choice(n, m, replace=False))
+    return np.ascontiguousarray(vectors[rows])
+
+def build_streaming(catalog_path: str, out: Path, model_name: str, backend: str, index_type: str,
+                    index_overrides: dict, read_chunk: int, workers: int, threads: int):
+    """
+    Bounded-memory build in two passes over disk:
+      1. read -> embed one chunk at a time; embeddings go to the vectors.npy
+         memmap, metadata is appended to meta.parquet row group by row group,
+         keyword/BM25 postings are accumulated in compact form;
+      2. train the IVF index on a random sample read back from the memmap,
+         then add the vectors to it in read_chunk slices.
+    Neither the texts nor the embeddings are ever held in full. Only IVF
+    types are accepted: ivfpq keeps ~n * (pq_m + 8) bytes in RAM; ivfflat
+    keeps every vector (n*d*4 bytes), like flat / HNSW, and is only warned about.
+    Returns (params, (n, d), model revision).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if index_type not in STREAM_INDEX_TYPES:
+        raise SystemExit(f"--stream with --index-type {index_type} would hold all n*d*4 bytes of "
+                         f"embeddings in RAM; use --index-type ivfpq (or build without --stream)")
+    if index_type == "ivfflat":
+        print("[WARN] ivfflat stores every vector in its inverted lists (n*d*4 bytes in RAM); "
+              "ivfpq keeps memory bounded")
+    # whole encode chunks per read, so the embeddings equal the in-memory build's
+    read_chunk = max(ENCODE_CHUNK, int(read_chunk) // ENCODE_CHUNK * ENCODE_CHUNK)
+    n, dtypes = scan_catalog(catalog_path, read_chunk)
+    if n == 0:
+        raise SystemExit(f"Catalog is empty: {catalog_path}")
+    print(f"[INFO] Streaming {n} rows from {catalog_path} in chunks of {read_chunk} "
+          f"(model: {model_name}, backend={backend})")
+
+    schema = pa.schema([(c, pa.float64() if c == "duration_min" else pa.string()) for c in SAFE_COLS])
+    vectors, at = None, 0
+    keyword_rows = {}   # term -> [row id arrays]
+    bm25 = BM25Builder()
+    with DocEncoder(model_name, backend, workers, threads, total=n) as enc, \
+            pq.ParquetWriter(str(out / "meta.parquet"), schema) as writer:
+        for df in iter_catalog(catalog_path, read_chunk):
+            if at + len(df) > n:
+                raise SystemExit(f"{catalog_path} grew while indexing (expected {n} rows)")
+            for c, dt in dtypes.items():   # the whole-file dtypes, see scan_catalog
+                if c in df.columns and df[c].dtype != dt:
+                    df[c] = df[c].astype(dt)
+            df = prepare_catalog(df)
+            X = enc.encode(df["doc"].tolist())
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(str(out / "vectors.npy"), mode="w+",
+                                                    dtype=np.float32, shape=(n, X.shape[1]))
+            vectors[at:at + len(X)] = X
+
+            meta = _meta_frame(df)
+            writer.write_table(pa.Table.from_pandas(meta, schema=schema, preserve_index=False))
+            blob = precompute_rerank_arrays(meta)["text_blob"]
+            for term, bits in build_keyword_postings(blob).items():
+                hit = np.unpackbits(bits, count=len(df), bitorder="little")
+                keyword_rows.setdefault(term, []).append(np.flatnonzero(hit) + at)
+            bm25.add(df["doc"].tolist())
+            at += len(df)
+        revision = enc.revision
+
+    vectors.flush()
+    d = vectors.shape[1]
+    if at != n:
+        raise SystemExit(f"{catalog_path} changed while indexing ({at} rows read, expected {n})")
+
+    params = finish_params(index_type, n, d, index_overrides)
+    index = new_faiss_index(d, params)
+    train_faiss_index(index, train_sample(vectors, params), params)
+    for s in range(0, n, read_chunk):
+        index.add(np.ascontiguousarray(vectors[s:s + read_chunk]))
+    del vectors
+    faiss.write_index(index, str(out / "faiss.index"))
+    (out / PARAMS_FILE).write_text(json.dumps(params, indent=2))
+    del index
+
+    terms = sorted(keyword_rows)
+    bits = np.zeros((len(terms), (n + 7) // 8), dtype=np.uint8)
+    for i, term in enumerate(terms):
+        hit = np.zeros(n, dtype=bool)
+        hit[np.concatenate(keyword_rows[term])] = True
+        bits[i] = np.packbits(hit, bitorder="little")
+    np.savez(str(out / KEYWORDS_FILE), n=np.int64(n), terms=np.array(terms), bits=bits)
+    bm25.finish().save(str(out / BM25_FILE))
+
+    # only the few attribute columns are read back
+    attr_cols = ["test_type", "level", "language", "duration_min"]
+    AttributeIndex.build(pd.read_parquet(str(out / "meta.parquet"), columns=attr_cols)).save(
+        str(out / ATTRIBUTES_FILE))
+    return params, (n, d), revision
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("--catalog", required=True, help="Path to data/shl_catalog.csv")
+    ap.add_argument("--catalog", help="Path to data/shl_catalog.csv (or a .parquet catalog)")
     ap.add_argument("--outdir", default="index", help="Output dir for FAISS + meta")
     ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2",
                     help="Sentence-Transformer model name")
+    ap.add_argument("--backend", default="torch", choices=BACKENDS,
+                    help="Encoder runtime (onnx* export the model on first use)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Encoder processes (each loads the model); embeddings are bit-identical to "
+                         "--workers 1 only with the same --threads on both runs")
+    ap.add_argument("--threads", type=int,
+                    help="Torch threads per encoder process (default cores / workers; --workers 1 "
+                         "without --threads leaves torch's own default, i.e. all cores)")
+    ap.add_argument("--verify", type=int, default=0,
+                    help="With --workers > 1: re-encode the first N docs in-process with the "
+                         "workers' thread count and require identical bits")
+    ap.add_argument("--stream", action="store_true",
+                    help="Bounded-memory build: read, embed and write the catalog chunk by chunk")
+    ap.add_argument("--read-chunk", type=int, default=50_000,
+                    help="Rows per chunk with --stream (rounded to whole encode chunks of 1024)")
+    ap.add_argument("--manifest-only", action="store_true",
+                    help="Only write manifest.json for the existing index in --outdir (built with --model)")
+    ap.add_argument("--versioned", action="store_true",
+                    help="Write to <outdir>/versions/<timestamp>-<pid>/ and switch <outdir>/CURRENT to it")
+    ap.add_argument("--index-type", choices=INDEX_TYPES,
+                    help="flat = exact (default); hnsw / ivfflat / ivfpq = approximate, sub-linear "
+                         "(--stream: ivfpq, the default there, or ivfflat)")
+    ap.add_argument("--hnsw-m", type=int, help="HNSW graph degree (default 32)")
+    ap.add_argument("--ef-construction", type=int, help="HNSW build beam (default 200)")
+    ap.add_argument("--ef-search", type=int, help="HNSW search beam, applied at load (default 128)")
+    ap.add_argument("--nlist", type=int, help="IVF cells (default ~4*sqrt(n), capped at n//39)")
+    ap.add_argument("--nprobe", type=int, help="IVF cells probed per query, applied at load (default 16)")
+    ap.add_argument("--pq-m", type=int, help="IVF-PQ sub-quantizers (must divide dim)")
+    ap.add_argument("--pq-nbits", type=int, help="IVF-PQ bits per code (default 8)")
     args = ap.parse_args()
-    main(args.catalog, args.outdir, args.model)
+    if args.manifest_only:
+        manifest_only(args.outdir, args.model)
+        raise SystemExit(0)
+    if not args.catalog:
+        ap.error("--catalog is required")
+    overrides = {
+        "M": args.hnsw_m, "efConstruction": args.ef_construction, "efSearch": args.ef_search,
+        "nlist": args.nlist, "nprobe": args.nprobe, "pq_m": args.pq_m, "pq_nbits": args.pq_nbits,
+    }
+    index_type = args.index_type or ("ivfpq" if args.stream else "flat")
+    main(args.catalog, args.outdir, args.model, args.backend, index_type, overrides,
+         versioned=args.versioned, workers=args.workers, threads=args.threads, verify=args.verify,
+         stream=args.stream, read_chunk=args.read_chunk)
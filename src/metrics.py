@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Minimal in-process metrics: labelled counters and histograms rendered in the
+Prometheus text format, plus per-request stage timings (for Server-Timing).
+
+Stages are timed with `span("encode")`. Every span feeds the
+`shl_stage_seconds{stage=...}` histogram and, if a request has installed a
+timing dict via `request_timings`, is also added to that dict.
+"""
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# stage -> seconds for the current request (None outside a request)
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {v:g}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, row in sorted(self._values.items()):
+                for b, c in zip(self.buckets, row):
+                    le = _fmt_labels(self.labelnames, key, 'le="%g"' % b)
+                    lines.append(f"{self.name}_bucket{le} {c:g}")
+                le = _fmt_labels(self.labelnames, key, 'le="+Inf"')
+                labels = _fmt_labels(self.labelnames, key)
+                lines.append(f"{self.name}_bucket{le} {row[-1]:g}")
+                lines.append(f"{self.name}_sum{labels} {row[-2]:.6f}")
+                lines.append(f"{self.name}_count{labels} {row[-1]:g}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable[[], List[str]]) -> None:
+        """fn() returns extra exposition lines (e.g. gauges read from cache stats)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        for fn in self._collectors:
+            try:
+                lines.extend(fn())
+            except Exception as e:   # a broken collector must not take /metrics down
+                lines.append(f"# collector error: {type(e).__name__}: {e}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "shl_stage_seconds", "Time spent per pipeline stage.", ["stage"]))
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+def record(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def run_with_timings(fn, *args, **kwargs):
+    """Call fn with a fresh timing dict installed; returns (result, timings)."""
+    timings: Dict[str, float] = {}
+    token = request_timings.set(timings)
+    try:
+        return fn(*args, **kwargs), timings
+    finally:
+        request_timings.reset(token)
+
+def merge_timings(timings: Dict[str, float]) -> None:
+    """Add timings measured elsewhere (e.g. in a shared batch) to the current request."""
+    current = request_timings.get()
+    if current is not None:
+        for k, v in timings.items():
+            current[k] = current.get(k, 0.0) + v
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Server-Timing value, durations in milliseconds."""
+    return ", ".join(f"{k};dur={v * 1000.0:.2f}" for k, v in timings.items())
+
+def gauge_lines(name: str, help: str, values: Dict[Tuple[Tuple[str, str], ...], float],
+                kind: str = "gauge") -> List[str]:
+    """Exposition lines for values computed at scrape time."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, v in values.items():
+        names, vals = zip(*labels) if labels else ((), ())
+        lines.append(f"{name}{_fmt_labels(names, vals)} {float(v):g}")
+    return lines
+
+def process_memory() -> Dict[str, int]:
+    """
+    Memory of this process in bytes. On Linux, smaps_rollup separates pages
+    shared with other workers (copy-on-write, page cache) from private ones:
+      rss    resident set
+      pss    proportional set (shared pages divided among the sharers)
+      uss    private pages only (what this worker really costs)
+      shared shared pages
+    Elsewhere only peak RSS from getrusage is available.
+    """
+    try:
+        fields = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[-1] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+        return {
+            "rss": fields.get("Rss", 0),
+            "pss": fields.get("Pss", 0),
+            "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+            "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        }
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"peak_rss": peak * (1 if os.uname().sysname == "Darwin" else 1024)}
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime encoder backend for CPU query encoding.
+
+Exports the transformer of a SentenceTransformer to ONNX (optionally with
+dynamic int8 quantization) and re-implements its tokenization, mean pooling
+and L2 normalization in NumPy, so embeddings match the torch model.
+
+Usage:
+  python src/onnx_encoder.py --model sentence-transformers/all-mpnet-base-v2 \
+    --outdir onnx_models --quantize --check
+"""
+import argparse
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ONNX_DIR = "onnx_models"
+CONFIG_FILE = "encoder_config.json"
+
+def _require_onnxruntime():
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError(
+            "The ONNX backend needs onnxruntime: pip install onnxruntime onnx"
+        ) from e
+    return ort
+
+def model_dir(model_name: str, root: str = ONNX_DIR) -> Path:
+    return Path(root) / re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+# ----------------------------
+# Export
+# ----------------------------
+def export_onnx(model_name: str, root: str = ONNX_DIR, quantize: bool = False,
+                opset: int = 14) -> Path:
+    """
+    Export `model_name` to `<root>/<model>/model.onnx` (+ model.int8.onnx when
+    quantize=True) together with its tokenizer and pooling config.
+    Returns the output directory.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out = model_dir(model_name, root)
+    out.mkdir(parents=True, exist_ok=True)
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = st[0], st[1]
+    if not getattr(pooling, "pooling_mode_mean_tokens", False) or any(
+        getattr(pooling, m, False) for m in
+        ("pooling_mode_cls_token", "pooling_mode_max_tokens", "pooling_mode_mean_sqrt_len_tokens")
+    ):
+        raise ValueError(f"{model_name}: only plain mean pooling is supported by the ONNX backend")
+
+    tokenizer = st.tokenizer
+    sample = tokenizer(["export sample"], padding=True, truncation=True, return_tensors="pt")
+    input_names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in sample]
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, *args):
+            return self.m(**dict(zip(input_names, args))).last_hidden_state
+
+    onnx_path = out / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            _Wrapper(transformer.auto_model.eval()),
+            tuple(sample[k] for k in input_names),
+            str(onnx_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{k: {0: "batch", 1: "seq"} for k in input_names},
+                          "last_hidden_state": {0: "batch", 1: "seq"}},
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(str(out))
+
+    if quantize:
+        _require_onnxruntime()
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(onnx_path), str(out / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    cfg = {
+        "model_name": model_name,
+        "max_seq_length": int(transformer.max_seq_length),
+        "do_lower_case": bool(getattr(transformer, "do_lower_case", False)),
+        "normalize": any(type(m).__name__ == "Normalize" for m in st),
+        "dim": int(st.get_sentence_embedding_dimension()),
+        "input_names": input_names,
+    }
+    (out / CONFIG_FILE).write_text(json.dumps(cfg, indent=2))
+    print(f"[DONE] Exported {model_name} to {out}" + (" (+int8)" if quantize else ""))
+    return out
+
+# ----------------------------
+# Runtime encoder
+# ----------------------------
+class OnnxEncoder:
+    """
+    Drop-in for the subset of SentenceTransformer.encode used in this repo.
+    """
+    def __init__(self, export_dir: str, quantized: bool = False,
+                 intra_op_threads: Optional[int] = None):
+        ort = _require_onnxruntime()
+        from transformers import AutoTokenizer
+
+        d = Path(export_dir)
+        self.config = json.loads((d / CONFIG_FILE).read_text())
+        self.model_name = self.config["model_name"]
+        self.max_seq_length = self.config["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(d))
+
+        onnx_file = d / ("model.int8.onnx" if quantized else "model.onnx")
+        if not onnx_file.exists():
+            raise FileNotFoundError(f"Missing {onnx_file}; run export_onnx(quantize={quantized})")
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            so.intra_op_num_threads = int(intra_op_threads)
+        self.session = ort.InferenceSession(str(onnx_file), so, providers=["CPUExecutionProvider"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self.config["dim"])
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        # mirrors sentence_transformers.models.Transformer.tokenize
+        texts = [str(t).strip() for t in texts]
+        if self.config["do_lower_case"]:
+            texts = [t.lower() for t in texts]
+        enc = self.tokenizer(texts, padding=True, truncation="longest_first",
+                             max_length=self.max_seq_length, return_tensors="np")
+        feeds = {k: enc[k].astype(np.int64) for k in self.config["input_names"]}
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+
+        # mean pooling over non-padding tokens (same as models.Pooling)
+        mask = feeds["attention_mask"][..., None].astype(hidden.dtype)
+        summed = (hidden * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        return summed / counts
+
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = False,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # length-sorted batches keep padding small; order is restored below
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for s in range(0, len(texts), batch_size):
+            idx = order[s:s + batch_size]
+            out[idx] = self._embed_batch([texts[i] for i in idx])
+
+        if normalize_embeddings or self.config["normalize"]:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+def load_encoder(model_name: str, quantized: bool = False, root: str = ONNX_DIR,
+                 intra_op_threads: Optional[int] = None) -> OnnxEncoder:
+    """Load an exported encoder, exporting it first if it is not on disk yet."""
+    d = model_dir(model_name, root)
+    onnx_file = d / ("model.int8.onnx" if quantized else "model.onnx")
+    if not onnx_file.exists() or not (d / CONFIG_FILE).exists():
+        export_onnx(model_name, root, quantize=quantized)
+    return OnnxEncoder(str(d), quantized=quantized, intra_op_threads=intra_op_threads)
+
+# ----------------------------
+# Parity check
+# ----------------------------
+def parity_check(torch_model, onnx_encoder: OnnxEncoder, sentences: List[str]) -> Dict[str, float]:
+    """Cosine agreement between torch and ONNX embeddings of the same texts."""
+    A = np.asarray(torch_model.encode(sentences, normalize_embeddings=True), dtype=np.float32)
+    B = onnx_encoder.encode(sentences, normalize_embeddings=True)
+    cos = (A * B).sum(axis=1)
+    return {
+        "n": len(sentences),
+        "mean_cosine": float(cos.mean()),
+        "min_cosine": float(cos.min()),
+        "max_drift": float((1.0 - cos).max()),
+        "max_abs_diff": float(np.abs(A - B).max()),
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default="sentence-transformers/all-mpnet-base-v2")
+    ap.add_argument("--outdir", default=ONNX_DIR, help="Root dir for exported models")
+    ap.add_argument("--quantize", action="store_true", help="Also write a dynamic int8 model")
+    ap.add_argument("--check", action="store_true", help="Report cosine drift vs torch on the catalog")
+    ap.add_argument("--catalog", default="Data/shl_catalog.csv", help="Texts for --check")
+    args = ap.parse_args()
+
+    export_onnx(args.model, args.outdir, quantize=args.quantize)
+    if args.check:
+        import pandas as pd
+        from sentence_transformers import SentenceTransformer
+        from indexer import build_doc
+
+        docs = pd.read_csv(args.catalog).apply(build_doc, axis=1).tolist()
+        st = SentenceTransformer(args.model, device="cpu")
+        for q in ([False, True] if args.quantize else [False]):
+            enc = OnnxEncoder(str(model_dir(args.model, args.outdir)), quantized=q)
+            print(f"[PARITY] {'int8' if q else 'fp32'}: {parity_check(st, enc, docs)}")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of a single request (see POST /admin/profile).
+
+Runs a call under cProfile and sums each function's own time into the
+library it belongs to, so a slow query shows at a glance whether the time
+went to the transformer (torch), FAISS, pandas, regex (the gate/duration
+parsing) or the app's own code. Nothing here is imported into the request
+path; it costs nothing unless called.
+
+On Python 3.12+ (runtime.txt) cProfile hooks in through sys.monitoring,
+which is process-wide: while a profile runs, every other thread's Python
+calls are recorded too (and pay the overhead), and a second profiler
+cannot start. `profile_call` therefore admits one profile per process at a
+time and raises ProfilerBusy otherwise. Native code running without the
+GIL (torch, FAISS kernels) is invisible to it either way.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+# first match wins; matched against "<file>:<function>" of each profiled function
+CATEGORIES: List[Tuple[str, Tuple[str, ...]]] = [
+    ("torch", ("torch",)),
+    ("tokenizers", ("tokenizers", "tokenization_", "transformers/tokenization")),
+    ("transformers", ("sentence_transformers", "transformers")),
+    ("onnxruntime", ("onnxruntime",)),
+    ("faiss", ("faiss",)),
+    ("pandas", ("pandas",)),
+    ("regex", ("/re/", "/re.py:", "/sre_", "'re.Pattern'", "_sre.")),
+    ("numpy", ("numpy",)),
+    ("app", ("/src/",)),
+]
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is running in this process."""
+
+_active = threading.Lock()
+
+def profile_call(fn: Callable, *args, **kwargs) -> Tuple[Any, pstats.Stats, float]:
+    """
+    (result, stats, wall seconds) of fn(*args, **kwargs) under cProfile.
+    Raises ProfilerBusy instead of waiting if a profile is already running.
+    """
+    if not _active.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running in this process")
+    try:
+        prof = cProfile.Profile()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            prof.disable()
+        wall = time.perf_counter() - t0
+        return result, pstats.Stats(prof), wall
+    finally:
+        _active.release()
+
+def _category(filename: str, funcname: str) -> str:
+    where = f"{filename.replace(chr(92), '/')}:{funcname}"
+    for name, needles in CATEGORIES:
+        if any(n in where for n in needles):
+            return name
+    return "other"
+
+def breakdown(stats: pstats.Stats) -> Dict[str, float]:
+    """Own (tottime) milliseconds per library, largest first."""
+    totals: Dict[str, float] = {}
+    for (filename, _line, funcname), (_cc, _nc, tottime, _ct, _callers) in stats.stats.items():
+        cat = _category(filename, funcname)
+        totals[cat] = totals.get(cat, 0.0) + tottime * 1000.0
+    return {k: round(v, 3) for k, v in sorted(totals.items(), key=lambda kv: -kv[1])}
+
+def top_functions(stats: pstats.Stats, n: int = 25, sort: str = "cumulative") -> List[Dict[str, Any]]:
+    key = 3 if sort == "cumulative" else 2
+    rows = sorted(stats.stats.items(), key=lambda kv: -kv[1][key])[:n]
+    return [{
+        "function": f"{Path(filename).name}:{line}({funcname})" if filename != "~" else funcname,
+        "calls": nc,
+        "own_ms": round(tottime * 1000.0, 3),
+        "cumulative_ms": round(cumtime * 1000.0, 3),
+        "category": _category(filename, funcname),
+    } for (filename, line, funcname), (_cc, nc, tottime, cumtime, _callers) in rows]
+
+def pstats_text(stats: pstats.Stats, n: int = 40) -> str:
+    buf = io.StringIO()
+    stats.stream = buf
+    stats.sort_stats("cumulative").print_stats(n)
+    return buf.getvalue()
+
+def pstats_bytes(stats: pstats.Stats) -> bytes:
+    """Same bytes as Stats.dump_stats() would write."""
+    return marshal.dumps(stats.stats)
+
+def save(stats: pstats.Stats, directory: str, tag: str) -> Path:
+    """Dump a .pstats file (open with snakeviz, or `python -m pstats`)."""
+    d = Path(directory)
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / f"{time.strftime('%Y%m%d-%H%M%S')}-{tag}.pstats"
+    stats.dump_stats(str(path))
+    return path
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Non-blocking JSONL request log (the input format of bench/replay.py).
+
+Request handlers only build a small dict and `put_nowait` it on a bounded
+queue; a background thread serializes, writes and rotates. When the queue is
+full the record is dropped and counted - the request path never waits on
+disk. Files rotate by size to <path>.1 ... <path>.<backups>.
+
+Under gunicorn, put "{pid}" in the path so each worker writes its own file.
+The writer also reopens its file when the inode changes (external logrotate).
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+_STOP = object()
+
+def query_hash(q: str) -> str:
+    return hashlib.blake2b(q.encode("utf-8"), digest_size=8).hexdigest()
+
+class RequestLog:
+    def __init__(self, path: str, max_queue: int = 10000, max_bytes: int = 50 * 1024 * 1024,
+                 backups: int = 5, flush_every: int = 256):
+        self.path_template = path
+        self.path: Optional[Path] = None
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.max_bytes = int(max_bytes)
+        self.backups = int(backups)
+        self.flush_every = int(flush_every)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._inode = None
+        self._lock = threading.Lock()   # counters only
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+
+    # ---------- request path
+    def log(self, record: Dict[str, Any]) -> bool:
+        """Enqueue without blocking; False (and counted) if the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    # ---------- writer
+    def start(self) -> None:
+        """Start the writer (call in each worker, after fork)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.path = Path(self.path_template.replace("{pid}", str(os.getpid())))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="request-log", daemon=True)
+        self._thread.start()
+        print(f"[INFO] Logging requests to {self.path}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Drain what is queued, then stop the writer."""
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _reopen_if_moved(self) -> None:
+        try:
+            moved = os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            moved = True
+        if moved:
+            self._file.close()
+            self._open()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink(missing_ok=True)
+        self.rotations += 1
+        self._open()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        if self.max_bytes and self._file.tell() + len(line) > self.max_bytes and self._file.tell() > 0:
+            self._rotate()
+        self._file.write(line)
+        self.written += 1
+
+    def _run(self) -> None:
+        self._open()
+        while True:
+            item = self.queue.get()
+            # drain whatever else is queued, then flush once for the whole burst
+            batch = [item]
+            while len(batch) < self.flush_every:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            try:
+                self._reopen_if_moved()
+                for rec in batch:
+                    if rec is _STOP:
+                        stop = True
+                        continue
+                    self._write(rec)
+                self._file.flush()
+            except Exception as e:   # a full disk must not kill the writer
+                self.errors += 1
+                print(f"[WARN] Request log write failed: {type(e).__name__}: {e}")
+            if stop:
+                self._file.close()
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path) if self.path else self.path_template,
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
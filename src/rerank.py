@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Query parsing + vectorized rerank stage for /recommend.
+
+The per-row work (joining text columns, parsing duration) is done once per
+index in `precompute_rerank_arrays`; a request only gathers candidate rows
+from those arrays and scores them with NumPy.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from src.metrics import span
+except ModuleNotFoundError:
+    from metrics import span  # type: ignore
+
+# columns searched by the keyword relevance gate
+GATE_COLUMNS = ["title", "description", "tags", "category"]
+
+# small whitelist of useful "strong" terms
+STRONG_TERMS = {
+    "python","sql","excel","powerbi","tableau","r","statistics","statistical",
+    "developer","engineer","analyst","data","qa","testing","automation",
+    "communication","stakeholder","manager","sales","marketing","java","javascript"
+}
+
+# ----------------------------
+# Query parsing
+# ----------------------------
+def extract_duration_window(text: str):
+    """
+    Return (min_min, max_min) if query mentions duration like:
+      - '40 minutes'
+      - '1-2 hours'
+      - 'about 60 min'
+    Otherwise return None.
+    """
+    t = (text or "").lower()
+
+    # Range, e.g. "1-2 hour(s)" or "45-60 min"
+    m = re.search(r"(\d+)\s*-\s*(\d+)\s*(hour|hr|hours|hrs|minute|min|minutes)\b", t)
+    if m:
+        a, b, unit = int(m.group(1)), int(m.group(2)), m.group(3)
+        if "hour" in unit:
+            a, b = a * 60, b * 60
+        return (min(a, b), max(a, b))
+
+    # Single value, e.g. "60 minutes", "1 hour"
+    m = re.search(r"(\d+)\s*(hour|hr|hours|hrs|minute|min|minutes)\b", t)
+    if m:
+        v, unit = int(m.group(1)), m.group(2)
+        if "hour" in unit:
+            v = v * 60
+        # soft window around target
+        return (max(0, v - 15), v + 15)
+
+    return None
+
+def strong_terms_from_query(q: str) -> List[str]:
+    # Extract words and keep the whitelisted “strong” terms
+    words = [w.lower() for w in re.findall(r"[a-zA-Z]+", q or "")]
+    return [w for w in words if w in STRONG_TERMS]
+
+# ----------------------------
+# Precomputed per-row arrays
+# ----------------------------
+def _to_minutes(v) -> float:
+    if v is None or pd.isna(v):
+        return np.nan
+    try:
+        return float(v)
+    except Exception:
+        return np.nan
+
+def precompute_rerank_arrays(meta: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    text_blob:    lowercase " ".join of GATE_COLUMNS per row (object array)
+    duration_min: float64 minutes, NaN where missing/unparseable
+    """
+    cols = [meta[c].tolist() if c in meta.columns else [""] * len(meta) for c in GATE_COLUMNS]
+    blob = np.array(
+        [" ".join(str(v or "") for v in vals).lower() for vals in zip(*cols)],
+        dtype=object,
+    )
+    if "duration_min" in meta.columns:
+        dur = np.fromiter((_to_minutes(v) for v in meta["duration_min"].tolist()),
+                          dtype=np.float64, count=len(meta))
+    else:
+        dur = np.full(len(meta), np.nan)
+    return {"text_blob": blob, "duration_min": dur}
+
+# ----------------------------
+# Inverted keyword index (built by indexer.py, loaded by retriever.py)
+# ----------------------------
+def build_keyword_postings(text_blob: np.ndarray, terms=None) -> Dict[str, np.ndarray]:
+    """
+    term -> packed row bitset (np.packbits, little bit order) of the rows whose
+    text blob contains the term. Uses the same substring test as the gate, so
+    a postings lookup and a scan always agree.
+    """
+    terms = sorted(terms if terms is not None else STRONG_TERMS)
+    postings = {}
+    for term in terms:
+        hit = np.fromiter((term in t for t in text_blob), dtype=bool, count=len(text_blob))
+        postings[term] = np.packbits(hit, bitorder="little")
+    return postings
+
+def postings_mask(postings: Dict[str, np.ndarray], terms: List[str], n: int) -> np.ndarray:
+    """Union of the posting bitsets of `terms` as a length-n bool mask."""
+    packed = np.zeros((n + 7) // 8, dtype=np.uint8)
+    for term in dict.fromkeys(terms):
+        packed |= postings[term]
+    return np.unpackbits(packed, count=n, bitorder="little").astype(bool)
+
+# ----------------------------
+# Rerank
+# ----------------------------
+def on_topic_mask(blobs: np.ndarray, strong: List[str]) -> np.ndarray:
+    """True where any strong term is a substring of the row's text blob."""
+    if len(blobs) == 0:
+        return np.zeros(0, dtype=bool)
+    text = blobs.astype(str)
+    mask = np.zeros(len(text), dtype=bool)
+    for term in dict.fromkeys(strong):
+        mask |= np.char.find(text, term) >= 0
+    return mask
+
+def gate_mask(arrays: Dict[str, np.ndarray], postings: Optional[Dict[str, np.ndarray]],
+              strong: List[str], rows: np.ndarray) -> np.ndarray:
+    """
+    On-topic mask for candidate `rows`: a bitset intersection when the index
+    has postings for the terms, a substring scan for any term it lacks.
+    """
+    indexed = [t for t in dict.fromkeys(strong) if postings and t in postings]
+    missing = [t for t in dict.fromkeys(strong) if not (postings and t in postings)]
+    keep = np.zeros(len(rows), dtype=bool)
+    if indexed:
+        # probe only the candidates' bits: O(len(rows)) per term, not O(n)
+        byte, bit = rows >> 3, (rows & 7).astype(np.uint8)
+        for term in indexed:
+            keep |= ((postings[term][byte] >> bit) & 1).astype(bool)
+    if missing:
+        keep |= on_topic_mask(arrays["text_blob"][rows], missing)
+    return keep
+
+def duration_scores(dur: np.ndarray, win: Optional[Tuple[int, int]]) -> np.ndarray:
+    """Linear falloff around the window center; 0 for missing durations."""
+    if not win:
+        return np.zeros(len(dur))
+    lo, hi = win
+    center = (lo + hi) / 2.0
+    tol = max(15.0, (hi - lo) / 2.0)
+    score = np.maximum(0.0, 1.0 - np.abs(dur - center) / tol)
+    return np.where(np.isnan(dur), 0.0, score)
+
+def rerank_candidates(arrays: Dict[str, np.ndarray], q: str, df: pd.DataFrame,
+                      topk: int, postings: Optional[Dict[str, np.ndarray]] = None) -> pd.DataFrame:
+    """
+    Keyword gate + duration boost over a `search` result frame (needs the
+    `row_id` and `similarity` columns). Hybrid results are ranked on their
+    fused `score` instead of `similarity`. Returns the top-k rows in final
+    order with `_dur_score` and `_final` columns.
+    """
+    rows = df["row_id"].to_numpy()
+    sim = df["score" if "score" in df.columns else "similarity"].to_numpy(dtype=np.float64)
+
+    # ---------- Keyword relevance gate (keeps on-topic items)
+    with span("gate"):
+        keep = np.ones(len(rows), dtype=bool)
+        strong = strong_terms_from_query(q)
+        if strong:
+            keep = gate_mask(arrays, postings, strong, rows)
+
+    # ---------- Duration awareness (soft boost if user asked for time)
+    with span("duration"):
+        dur_score = duration_scores(arrays["duration_min"][rows], extract_duration_window(q))
+
+    # ---------- Final score = 0.85 * semantic + 0.15 * duration_fit
+    final = 0.85 * sim + 0.15 * dur_score
+    idx = np.flatnonzero(keep)
+    idx = idx[np.argsort(-final[idx], kind="stable")][:topk]
+
+    out = df.iloc[idx].copy()
+    out["_dur_score"] = dur_score[idx]
+    out["_final"] = final[idx]
+    return out
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Response-level cache for /recommend.
+
+Keys combine the index version (IndexBundle.version: a checksum of the index
+artifacts plus the encoder/retrieval settings), the normalized query, topk and filters, so a
+rebuilt or reloaded index can never serve stale entries. The in-process LRU
+answers hits in microseconds; an optional SQLite file keeps entries across
+restarts and is shared by workers on the same host.
+
+SQLite never runs on the caller's hot path for writes: `put` fills the LRU
+and queues the row for a background writer thread, which inserts in
+batches and bounds the file (every `prune_every` inserts, rows past the TTL
+are deleted and the oldest rows beyond `db_max_rows` are dropped). Async
+callers read the disk tier through `get_disk` in a worker thread.
+"""
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    from src.retriever import LRUCache, normalize_query
+except ModuleNotFoundError:
+    from retriever import LRUCache, normalize_query  # type: ignore
+
+class ResultCache:
+    def __init__(self, maxsize: int = 2048, ttl: Optional[float] = 3600.0,
+                 db_path: Optional[str] = None, salt: str = "", db_max_rows: int = 100_000,
+                 prune_every: int = 500, write_queue: int = 10000):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = float(ttl) if ttl else None
+        self.version: Optional[str] = None
+        self.db_path = db_path
+        self.salt = salt   # serving settings outside the index version (e.g. the reranker)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._db_lock = threading.Lock()
+        self.db_max_rows = int(db_max_rows)   # 0 = no row cap (TTL pruning only)
+        self.prune_every = max(1, int(prune_every))
+        self._writes: "queue.Queue" = queue.Queue(maxsize=max(1, int(write_queue)))
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        self._inserted = 0
+        self.disk_hits = 0
+        self.disk_pruned = 0
+        self.disk_dropped = 0
+
+    @property
+    def _db(self) -> Optional[sqlite3.Connection]:
+        # opened lazily and per process: a connection must not cross a fork
+        if not self.db_path:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, version TEXT, created REAL, payload TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def make_key(self, version: str, query: str, topk: int, filters: Optional[Dict[str, Any]]) -> str:
+        raw = json.dumps([version, self.salt, normalize_query(query), int(topk), filters or {}],
+                         sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def set_version(self, version: str) -> None:
+        """Switch to a new index version, dropping every entry of older ones."""
+        if version == self.version:
+            return
+        self.version = version
+        self.memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM results WHERE version != ?", (version,))
+
+    def get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """In-process tier only (never blocks on disk)."""
+        return self.memory.get(key)
+
+    def get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        """SQLite tier (blocking; call from a worker thread in async code). Fills the LRU on a hit."""
+        if not self.db_path:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT created, payload FROM results WHERE key = ? AND version = ?",
+                (key, self.version),
+            ).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[0] > self.ttl):
+            return None
+        value = json.loads(row[1])
+        self.disk_hits += 1
+        self.memory.put(key, value)
+        return value
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.get_memory(key)
+        return value if value is not None else self.get_disk(key)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        self.memory.put(key, value)
+        if not self.db_path:
+            return
+        self._start_writer()
+        try:
+            self._writes.put_nowait((key, self.version, time.time(), value))
+        except queue.Full:
+            self.disk_dropped += 1   # the disk tier is best effort; the LRU already has it
+
+    # ---------- background writer
+    def _start_writer(self) -> None:
+        # per process, like the connection: a thread does not survive a fork
+        if self._writer is not None and self._writer_pid == os.getpid():
+            return
+        with self._db_lock:
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._writes = queue.Queue(maxsize=self._writes.maxsize)
+                self._writer = threading.Thread(target=self._write_loop, name="result-cache-writer",
+                                                daemon=True)
+                self._writer_pid = os.getpid()
+                self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                # rows of a version replaced meanwhile are not worth writing
+                rows = [(k, v, t, json.dumps(p)) for k, v, t, p in batch if v == self.version]
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO results (key, version, created, payload) VALUES (?, ?, ?, ?)",
+                        rows,
+                    )
+                    before = self._inserted
+                    self._inserted += len(rows)
+                    if self._inserted // self.prune_every != before // self.prune_every:
+                        self._prune()
+            except Exception as e:   # a full or locked disk must not kill the writer
+                print(f"[WARN] Result cache write failed: {type(e).__name__}: {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def flush(self) -> None:
+        """Wait until every queued row is written (tests, shutdown)."""
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._writes.join()
+
+    def _prune(self) -> None:
+        """Delete expired rows, then the oldest beyond db_max_rows (caller holds _db_lock)."""
+        pruned = 0
+        if self.ttl is not None:
+            pruned += self._db.execute("DELETE FROM results WHERE created < ?",
+                                       (time.time() - self.ttl,)).rowcount
+        if self.db_max_rows > 0:
+            pruned += self._db.execute(
+                "DELETE FROM results WHERE key IN"
+                " (SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.db_max_rows,),
+            ).rowcount
+        self.disk_pruned += max(0, pruned)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self._db is not None:
+            self.flush()
+            with self._db_lock:
+                self._db.execute("DELETE FROM results")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.memory.stats(), "version": self.version,
+                "disk": bool(self.db_path), "disk_hits": self.disk_hits, "disk_pruned": self.disk_pruned,
+                "disk_write_queue": self._writes.qsize(), "disk_dropped": self.disk_dropped}
@@ -2,32 +2,698 @@
 """
 Retriever utility to load FAISS index and run queries.
 """
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
 import numpy as np
 import pandas as pd
 from sentence_transformers import SentenceTransformer
 import faiss
 from pathlib import Path
 
+try:
+    from src.bm25 import BM25Index
+    from src.filters import AttributeIndex, combine_masks
+    from src.metrics import span
+    from src.rerank import precompute_rerank_arrays
+except ModuleNotFoundError:
+    from bm25 import BM25Index  # type: ignore
+    from filters import AttributeIndex, combine_masks  # type: ignore
+    from metrics import span  # type: ignore
+    from rerank import precompute_rerank_arrays  # type: ignore
+
 @dataclass
 class IndexBundle:
     index: faiss.Index
     vectors: np.ndarray
     meta: pd.DataFrame
-    model: SentenceTransformer
+    model: SentenceTransformer          # or onnx_encoder.OnnxEncoder (same encode() API)
+    model_name: str = ""
+    backend: str = "torch"
+    index_params: Optional[Dict[str, Any]] = None
+    rerank_arrays: Optional[Dict[str, np.ndarray]] = None   # see rerank.precompute_rerank_arrays
+    keyword_postings: Optional[Dict[str, np.ndarray]] = None  # term -> packed row bitset
+    bm25: Optional[BM25Index] = None
+    attributes: Optional[AttributeIndex] = None   # structured filters, see filters.py
+    indexdir: str = ""
+    version: str = ""             # checksum of index artifacts + encoder/retrieval settings
+    manifest: Optional[Dict[str, Any]] = None   # manifest.json written by indexer.py
+    retrieval: str = "dense"      # dense | hybrid
+    fusion: str = "rrf"           # rrf | weighted (hybrid only)
+
+# ----------------------------
+# Query-embedding cache
+# ----------------------------
+class LRUCache:
+    """
+    Thread-safe bounded LRU with optional TTL (seconds; None/0 = no expiry).
+    Keeps hit/miss/eviction counters for observability.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = float(ttl) if ttl else None
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            ts, value = item
+            if self.ttl is not None and time.monotonic() - ts > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+query_cache = LRUCache(
+    maxsize=int(os.environ.get("SHL_QUERY_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("SHL_QUERY_CACHE_TTL", "3600")),
+)
+
+def configure_query_cache(maxsize: int = 1024, ttl: Optional[float] = 3600.0) -> LRUCache:
+    """Replace the module-level query cache (e.g. from API config)."""
+    global query_cache
+    query_cache = LRUCache(maxsize=maxsize, ttl=ttl)
+    return query_cache
+
+# ----------------------------
+# CPU thread budget
+# ----------------------------
+_encode_slots: Optional[threading.BoundedSemaphore] = None
+thread_budget: Dict[str, Optional[int]] = {"torch_threads": None, "faiss_threads": None,
+                                           "encode_concurrency": None}
+
+def set_thread_budget(torch_threads: Optional[int] = None, faiss_threads: Optional[int] = None,
+                      encode_concurrency: Optional[int] = None) -> Dict[str, Optional[int]]:
+    """
+    Pin intra-op threads for torch and FAISS (OpenMP) and cap how many
+    forward passes may run at once in this process. Without this, every
+    threadpool request runs torch + FAISS on all cores and they oversubscribe
+    the CPU. None leaves a setting unchanged. Call after fork, in the worker.
+    """
+    global _encode_slots
+    if torch_threads:
+        import torch
+        torch.set_num_threads(int(torch_threads))
+        thread_budget["torch_threads"] = int(torch_threads)
+    if faiss_threads:
+        thread_budget["faiss_threads"] = int(faiss_threads)
+        _apply_faiss_threads()
+    if encode_concurrency:
+        _encode_slots = threading.BoundedSemaphore(int(encode_concurrency))
+        thread_budget["encode_concurrency"] = int(encode_concurrency)
+    return dict(thread_budget)
+
+_faiss_tls = threading.local()
+
+def _apply_faiss_threads() -> None:
+    """
+    omp_set_num_threads only binds the calling thread (and threads it starts
+    later do not inherit it), so every thread that searches applies the
+    budget itself, once: search_vectors calls this first.
+    """
+    n = thread_budget["faiss_threads"]
+    if n and getattr(_faiss_tls, "omp_threads", None) != n:
+        faiss.omp_set_num_threads(n)
+        _faiss_tls.omp_threads = n
+
+class _encode_slot:
+    """Hold one encode slot (no-op when encode concurrency is unbounded)."""
+    def __enter__(self):
+        self._sem = _encode_slots
+        if self._sem is not None:
+            self._sem.acquire()
+
+    def __exit__(self, *exc):
+        if self._sem is not None:
+            self._sem.release()
+
+def query_cache_stats() -> Dict[str, Any]:
+    return query_cache.stats()
+
+def normalize_query(text: str) -> str:
+    # whitespace is not significant to the tokenizer, so collapse it for the key
+    return re.sub(r"\s+", " ", (text or "").strip())
+
+def encode_queries(bundle: IndexBundle, queries: List[str], batch_size: int = 32,
+                   use_cache: bool = True) -> np.ndarray:
+    """
+    Encode queries to a float32 (n, d) matrix, serving repeats from `query_cache`
+    and running a single batched forward pass over the misses.
+    use_cache=False always encodes (e.g. when profiling the encoder).
+    """
+    model_key = f"{bundle.model_name or id(bundle.model)}@{bundle.backend}"
+    keys = [(model_key, normalize_query(q)) for q in queries]
+    cache = query_cache if use_cache else LRUCache(maxsize=0)
+
+    rows: List[Optional[np.ndarray]] = [cache.get(k) for k in keys]
+    todo = [i for i, r in enumerate(rows) if r is None]
+    if todo:
+        # de-duplicate within the batch so each distinct text is encoded once
+        uniq = list(dict.fromkeys(keys[i][1] for i in todo))
+        with _encode_slot():
+            with span("encode"):
+                X = bundle.model.encode(uniq, normalize_embeddings=True, batch_size=batch_size)
+        X = np.asarray(X, dtype=np.float32)
+        fresh = dict(zip(uniq, X))
+        for i in todo:
+            rows[i] = fresh[keys[i][1]]
+        for text, vec in fresh.items():
+            cache.put((model_key, text), vec)
+    return np.ascontiguousarray(np.vstack(rows), dtype=np.float32)
+
+# ----------------------------
+# Loading
+# ----------------------------
+def _read_index_mmap(path: str) -> faiss.Index:
+    """
+    Read a FAISS index backed by the file mapping instead of private heap.
+    IO_FLAG_MMAP_IFC (faiss >= 1.11) maps IndexFlat codes zero-copy; older
+    builds only honour IO_FLAG_MMAP for IVF inverted lists.
+    """
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if ifc is not None:
+        try:
+            return faiss.read_index(path, ifc | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+def _flat_codes_view(index: faiss.Index) -> Optional[np.ndarray]:
+    """Zero-copy (n, d) float32 view over an IndexFlat's stored vectors."""
+    flat = faiss.downcast_index(index)
+    if not isinstance(flat, faiss.IndexFlat) or flat.ntotal == 0:
+        return None
+    n, d = flat.ntotal, flat.d
+    return faiss.rev_swig_ptr(flat.get_xb(), n * d).reshape(n, d)
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+def load_model(model_name: str, backend: str = "torch", threads: Optional[int] = None,
+               revision: Optional[str] = None):
+    """
+    Query/document encoder for `model_name`.
+      torch     - SentenceTransformer (reference)
+      onnx      - onnxruntime fp32 export of the same model
+      onnx-int8 - onnxruntime with dynamic int8 quantized weights
+    `threads` sets onnxruntime's intra-op threads (torch uses set_thread_budget).
+    `revision` pins the hub commit of a torch model (as recorded in the manifest).
+    """
+    if backend == "torch":
+        return SentenceTransformer(model_name, revision=revision) if revision else SentenceTransformer(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        try:
+            from src.onnx_encoder import load_encoder
+        except ModuleNotFoundError:
+            from onnx_encoder import load_encoder  # type: ignore
+        return load_encoder(model_name, quantized=(backend == "onnx-int8"), intra_op_threads=threads)
+    raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {BACKENDS}")
+
+FUSIONS = ("rrf", "weighted")
+RRF_K = 60            # reciprocal-rank constant
+HYBRID_ALPHA = 0.7    # dense weight for fusion="weighted"
+
+# ----------------------------
+# Index versioning
+# ----------------------------
+# files read fully when hashing; larger ones are sampled (head/middle/tail + size)
+FULL_HASH_LIMIT = 64 * 1024 * 1024
+SAMPLE_BYTES = 1024 * 1024
+
+def file_checksum(path: Path, full_limit: int = FULL_HASH_LIMIT) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    size = path.stat().st_size
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= full_limit:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        else:
+            for offset in (0, size // 2, max(0, size - SAMPLE_BYTES)):
+                f.seek(offset)
+                h.update(f.read(SAMPLE_BYTES))
+    return h.hexdigest()
+
+# every artifact that can change search results
+INDEX_FILES = ("faiss.index", "vectors.npy", "meta.parquet", "index_params.json",
+               "keywords.npz", "bm25.npz", "attributes.npz")
+
+def index_version(indexdir: str, files: Iterable[str] = INDEX_FILES, extra: Iterable[str] = ()) -> str:
+    """Short digest of the index artifacts (missing files are skipped) + settings."""
+    h = hashlib.blake2b(digest_size=8)
+    for name in sorted(files):
+        p = Path(indexdir) / name
+        if p.exists():
+            h.update(name.encode())
+            h.update(file_checksum(p).encode())
+    for e in extra:
+        h.update(str(e).encode())
+    return h.hexdigest()
+
+# search-time defaults when an index was built without index_params.json
+SEARCH_DEFAULTS = {"hnsw": {"efSearch": 128}, "ivfflat": {"nprobe": 16}, "ivfpq": {"nprobe": 16}}
+
+def detect_index_type(index: faiss.Index) -> str:
+    idx = faiss.downcast_index(index)
+    if isinstance(idx, faiss.IndexHNSW):
+        return "hnsw"
+    try:
+        # extract_index_ivf hands back the IndexIVF base class; downcast to see PQ
+        ivf = faiss.downcast_index(faiss.extract_index_ivf(idx))
+    except RuntimeError:
+        return "flat"
+    return "ivfpq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivfflat"
+
+def apply_search_params(index: faiss.Index, params: Dict[str, Any]) -> None:
+    """Set efSearch / nprobe on the loaded index (no-op for flat)."""
+    ps = faiss.ParameterSpace()
+    for key in ("efSearch", "nprobe"):
+        if key in params:
+            ps.set_index_parameter(index, key, int(params[key]))
+
+def load_index_params(indexdir: str, index: faiss.Index) -> Dict[str, Any]:
+    """index_params.json written by indexer.py, else defaults for the detected type."""
+    kind = detect_index_type(index)
+    path = Path(indexdir) / "index_params.json"
+    params = json.loads(path.read_text()) if path.exists() else {}
+    if params.get("type", kind) != kind:
+        raise ValueError(f"{path} says {params['type']!r} but faiss.index is {kind!r}")
+    return {"type": kind, **SEARCH_DEFAULTS.get(kind, {}), **params}
+
+def load_keyword_postings(indexdir: str, n_rows: int) -> Optional[Dict[str, np.ndarray]]:
+    """keywords.npz written by indexer.py; None if absent or built for another catalog."""
+    path = Path(indexdir) / "keywords.npz"
+    if not path.exists():
+        return None
+    with np.load(str(path)) as z:
+        if int(z["n"]) != n_rows:
+            print(f"[WARN] {path} covers {int(z['n'])} rows, meta has {n_rows}; ignoring it")
+            return None
+        return {str(t): bits for t, bits in zip(z["terms"], z["bits"])}
+
+def load_bm25(indexdir: str, n_rows: int) -> Optional[BM25Index]:
+    path = Path(indexdir) / "bm25.npz"
+    if not path.exists():
+        return None
+    bm25 = BM25Index.load(str(path))
+    if bm25.n_docs != n_rows:
+        print(f"[WARN] {path} covers {bm25.n_docs} rows, meta has {n_rows}; ignoring it")
+        return None
+    return bm25
 
-def load_index(indexdir: str, model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> IndexBundle:
-    index = faiss.read_index(str(Path(indexdir) / "faiss.index"))
-    vectors = np.load(str(Path(indexdir) / "vectors.npy"))
+def load_attributes(indexdir: str, meta: pd.DataFrame) -> AttributeIndex:
+    """attributes.npz written by indexer.py; rebuilt from meta for older index dirs."""
+    path = Path(indexdir) / "attributes.npz"
+    if path.exists():
+        attrs = AttributeIndex.load(str(path))
+        if attrs.n == len(meta):
+            return attrs
+        print(f"[WARN] {path} covers {attrs.n} rows, meta has {len(meta)}; rebuilding in memory")
+    return AttributeIndex.build(meta)
+
+# ----------------------------
+# Manifest
+# ----------------------------
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT = 1
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"   # index dirs without a manifest
+QUICK_HASH_LIMIT = 3 * SAMPLE_BYTES   # manifest checksums: sampled above this, so ms per file
+
+def quick_checksum(path: Path) -> str:
+    return file_checksum(path, full_limit=QUICK_HASH_LIMIT)
+
+def model_revision(model) -> Optional[str]:
+    """Hub commit hash of a loaded SentenceTransformer, if transformers recorded it."""
+    try:
+        return getattr(model[0].auto_model.config, "_commit_hash", None)
+    except (AttributeError, IndexError, TypeError, KeyError):
+        return None
+
+def read_manifest(indexdir: str) -> Optional[Dict[str, Any]]:
+    path = Path(indexdir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    manifest = json.loads(path.read_text())
+    if int(manifest.get("format", 0)) > MANIFEST_FORMAT:
+        raise ValueError(f"{path}: manifest format {manifest['format']} is newer than this code supports")
+    return manifest
+
+def _npy_shape(path: Path) -> Tuple[Tuple[int, ...], str]:
+    with open(path, "rb") as f:
+        fmt = np.lib.format
+        read_header = fmt.read_array_header_1_0 if fmt.read_magic(f) == (1, 0) else fmt.read_array_header_2_0
+        shape, _fortran, dtype = read_header(f)   # header only, no data
+    return tuple(shape), dtype.str
+
+def _faiss_header(path: Path) -> Tuple[int, int]:
+    """(d, ntotal) from the common header every FAISS index file starts with."""
+    with open(path, "rb") as f:
+        _fourcc, d, ntotal = struct.unpack("<4siq", f.read(16))
+    return d, ntotal
+
+def validate_manifest(indexdir: str, manifest: Dict[str, Any]) -> None:
+    """
+    Check the artifacts against the manifest without loading them: file sizes
+    and sampled checksums, the faiss.index and vectors.npy headers, and the
+    meta.parquet row count from its footer. Raises ValueError on mismatch.
+    """
+    root = Path(indexdir)
+    rows, dim = int(manifest["rows"]), int(manifest["model"]["dim"])
+    problems = []
+    for name, info in manifest.get("files", {}).items():
+        p = root / name
+        if not p.exists():
+            problems.append(f"{name}: missing")
+        elif p.stat().st_size != int(info["bytes"]):
+            problems.append(f"{name}: {p.stat().st_size} bytes, manifest says {info['bytes']}")
+        elif quick_checksum(p) != info["checksum"]:
+            problems.append(f"{name}: checksum differs from the manifest")
+
+    if (root / "faiss.index").exists():
+        d, ntotal = _faiss_header(root / "faiss.index")
+        if (d, ntotal) != (dim, rows):
+            problems.append(f"faiss.index: d={d} ntotal={ntotal}, manifest says dim={dim} rows={rows}")
+    if (root / "vectors.npy").exists():
+        shape, dtype = _npy_shape(root / "vectors.npy")
+        if shape != (rows, dim) or dtype != "<f4":
+            problems.append(f"vectors.npy: {shape} {dtype}, manifest says ({rows}, {dim}) <f4")
+    if (root / "meta.parquet").exists():
+        import pyarrow.parquet as pq
+        n_meta = pq.ParquetFile(str(root / "meta.parquet")).metadata.num_rows
+        if n_meta != rows:
+            problems.append(f"meta.parquet: {n_meta} rows, manifest says {rows}")
+    if problems:
+        raise ValueError(f"Index {root} does not match its manifest:\n  " + "\n  ".join(problems))
+
+CURRENT_FILE = "CURRENT"   # pointer to the live version inside a versioned index dir
+
+def resolve_index_dir(indexdir: str) -> Path:
+    """
+    `indexdir` itself, or - for a versioned dir written by `indexer.py
+    --versioned` - the version named in its CURRENT file.
+    """
+    root = Path(indexdir)
+    pointer = root / CURRENT_FILE
+    if pointer.exists():
+        target = pointer.read_text().strip()
+        if target:
+            return root / target
+    return root
+
+def load_index(indexdir: str, model_name: Optional[str] = None,
+               mmap: bool = False, backend: str = "torch",
+               retrieval: str = "dense", fusion: str = "rrf",
+               encoder_threads: Optional[int] = None, model=None) -> IndexBundle:
+    """
+    `indexdir` may be a plain index dir or a versioned one (see resolve_index_dir).
+    Pass `model` to reuse an already loaded encoder (e.g. on hot reload).
+
+    model_name=None takes the encoder from the index's manifest.json (or
+    DEFAULT_MODEL for older dirs without one); an explicit name must match the
+    manifest. The manifest is validated before the model or index is loaded.
+
+    mmap=False: read everything into process memory (original behaviour), but
+    reuse the flat index's storage for `vectors` instead of a second copy.
+    mmap=True:  map faiss.index and vectors.npy read-only so that several
+    worker processes share the same page-cache pages.
+    """
+    indexdir = str(resolve_index_dir(indexdir))
+    manifest = read_manifest(indexdir)
+    revision = None
+    if manifest is not None:
+        built_with = manifest["model"]["name"]
+        if model_name is not None and model_name != built_with:
+            raise ValueError(f"{indexdir} was built with {built_with!r}, not {model_name!r}; "
+                             "drop the model override or rebuild the index")
+        model_name, revision = built_with, manifest["model"].get("revision")
+        validate_manifest(indexdir, manifest)
+    elif model_name is None:
+        model_name = DEFAULT_MODEL
+        print(f"[WARN] {indexdir} has no {MANIFEST_FILE}; assuming {model_name}")
+
+    index_path = str(Path(indexdir) / "faiss.index")
+    vectors_path = str(Path(indexdir) / "vectors.npy")
+    if mmap:
+        index = _read_index_mmap(index_path)
+        vectors = np.load(vectors_path, mmap_mode="r")
+    else:
+        index = faiss.read_index(index_path)
+        vectors = _flat_codes_view(index)
+        if vectors is None:
+            vectors = np.load(vectors_path)
+    index_params = load_index_params(indexdir, index)
+    apply_search_params(index, index_params)
     meta = pd.read_parquet(str(Path(indexdir) / "meta.parquet"))
-    model = SentenceTransformer(model_name)
-    return IndexBundle(index=index, vectors=vectors, meta=meta, model=model)
-
-def search(bundle: IndexBundle, query: str, topk: int = 10) -> pd.DataFrame:
-    q = bundle.model.encode([query], normalize_embeddings=True).astype(np.float32)
-    D, I = bundle.index.search(q, topk)
-    I, D = I[0], D[0]
-    out = bundle.meta.iloc[I].copy()
-    out["similarity"] = D
+    bm25 = load_bm25(indexdir, len(meta))
+    if retrieval == "hybrid" and bm25 is None:
+        raise FileNotFoundError(f"retrieval='hybrid' needs {Path(indexdir) / 'bm25.npz'}; rebuild with indexer.py")
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion {fusion!r}; expected one of {FUSIONS}")
+    if model is None:
+        model = load_model(model_name, backend, threads=encoder_threads, revision=revision)
+    dim = int(model.get_sentence_embedding_dimension())
+    if dim != index.d:
+        raise ValueError(f"{model_name} embeds to {dim} dims but {index_path} has d={index.d}; "
+                         "the index was built with a different model")
+    return IndexBundle(index=index, vectors=vectors, meta=meta, model=model,
+                       model_name=model_name, backend=backend, index_params=index_params,
+                       rerank_arrays=precompute_rerank_arrays(meta),
+                       keyword_postings=load_keyword_postings(indexdir, len(meta)),
+                       bm25=bm25, retrieval=retrieval, fusion=fusion,
+                       attributes=load_attributes(indexdir, meta), indexdir=str(indexdir),
+                       version=index_version(indexdir, extra=(model_name, backend, retrieval, fusion)),
+                       manifest=manifest)
+
+# ----------------------------
+# Search
+# ----------------------------
+BRUTE_FORCE_MAX = 4096   # filtered searches over <= this many rows are scored exactly
+
+def _selector_params(bundle: IndexBundle, sel) -> "faiss.SearchParameters":
+    # per-call params replace the index-level knobs, so carry them over
+    params = bundle.index_params or {}
+    kind = params.get("type", "flat")
+    if kind == "hnsw":
+        sp = faiss.SearchParametersHNSW()
+        sp.efSearch = int(params.get("efSearch", 128))
+    elif kind in ("ivfflat", "ivfpq"):
+        sp = faiss.SearchParametersIVF()
+        sp.nprobe = int(params.get("nprobe", 16))
+    else:
+        sp = faiss.SearchParameters()
+    sp.sel = sel
+    return sp
+
+def _exact_search(bundle: IndexBundle, Q: np.ndarray, topk: int,
+                  ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact inner-product top-k over the rows `ids`, padded with -1 like FAISS."""
+    D = np.full((len(Q), topk), -np.inf, dtype=np.float32)
+    I = np.full((len(Q), topk), -1, dtype=np.int64)
+    if len(ids) == 0:
+        return D, I
+    S = Q @ np.asarray(bundle.vectors[ids], dtype=np.float32).T
+    k = min(topk, len(ids))
+    if k < len(ids):
+        top = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(len(ids)), S.shape)
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(S, top, 1), axis=1, kind="stable"), 1)
+    D[:, :k] = np.take_along_axis(S, top, 1)
+    I[:, :k] = ids[top]
+    return D, I
+
+def search_vectors(bundle: IndexBundle, Q: np.ndarray, topk: int,
+                   allow: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    FAISS search for a (n, d) float32 query matrix. IVF-PQ distances are
+    approximate, so those hits are re-scored exactly against `vectors` to keep
+    `similarity` a true cosine.
+
+    `allow` (bool mask over rows) restricts the search: small allowed sets are
+    scored exactly, larger ones go through FAISS with an IDSelectorBitmap. If
+    an approximate index comes back short, the exact path fills the gap, so
+    the result holds min(topk, allowed rows) hits.
+    """
+    _apply_faiss_threads()
+    if allow is not None:
+        ids = np.flatnonzero(allow)
+        if len(ids) <= BRUTE_FORCE_MAX:
+            return _exact_search(bundle, Q, topk, ids)
+        bitmap = np.packbits(allow, bitorder="little")
+        # the size argument is the bitmap's length in bytes, not the row count
+        sel = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        D, I = bundle.index.search(Q, topk, params=_selector_params(bundle, sel))
+        if (I[:, :min(topk, len(ids))] < 0).any():
+            return _exact_search(bundle, Q, topk, ids)
+    else:
+        D, I = bundle.index.search(Q, topk)
+    if (bundle.index_params or {}).get("type") == "ivfpq":
+        safe = np.where(I >= 0, I, 0)
+        D = np.einsum("nd,nkd->nk", Q, np.asarray(bundle.vectors[safe.ravel()]).reshape(*I.shape, -1))
+        D = np.where(I >= 0, D, -np.inf).astype(np.float32)
+        order = np.argsort(-D, axis=1, kind="stable")
+        D, I = np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
+    return D, I
+
+def _results_frame(bundle: IndexBundle, I: np.ndarray, D: np.ndarray) -> pd.DataFrame:
+    # approximate indexes pad with -1 when fewer than topk hits are found
+    keep = I >= 0
+    out = bundle.meta.iloc[I[keep]].copy()
+    out["row_id"] = I[keep]
+    out["similarity"] = D[keep]
     return out.reset_index(drop=True)
+
+def _fuse(bundle: IndexBundle, query: str, q: np.ndarray,
+          dense_ids: np.ndarray, topk: int, allow: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Hybrid candidates: union of the dense top-k and BM25 top-k, ordered by a
+    fused `score` in [0, 1]. `similarity` stays the exact cosine for every row
+    (BM25-only hits are scored against `vectors`), and `bm25` is the raw score.
+    """
+    sparse_scores, sparse_ids = bundle.bm25.search(query, topk, allow=allow)
+    dense_ids = dense_ids[dense_ids >= 0]
+    ids = np.array(list(dict.fromkeys(np.concatenate([dense_ids, sparse_ids]).tolist())), dtype=np.int64)
+    if len(ids) == 0:
+        return _results_frame(bundle, ids, np.zeros(0, np.float32))
+
+    cos = np.asarray(bundle.vectors[ids], dtype=np.float32) @ q
+    bm = np.zeros(len(ids), dtype=np.float32)
+    pos = {int(r): j for j, r in enumerate(ids)}
+    bm[[pos[int(r)] for r in sparse_ids]] = sparse_scores
+
+    if bundle.fusion == "weighted":
+        bm_norm = bm / bm.max() if bm.max() > 0 else bm
+        score = HYBRID_ALPHA * cos + (1.0 - HYBRID_ALPHA) * bm_norm
+    else:
+        rrf = np.zeros(len(ids), dtype=np.float64)
+        rrf[:len(dense_ids)] += 1.0 / (RRF_K + np.arange(1, len(dense_ids) + 1))
+        rrf[[pos[int(r)] for r in sparse_ids]] += 1.0 / (RRF_K + np.arange(1, len(sparse_ids) + 1))
+        score = rrf / (2.0 / (RRF_K + 1))   # 1.0 = ranked first by both retrievers
+
+    order = np.argsort(-score, kind="stable")[:topk]
+    out = _results_frame(bundle, ids[order], cos[order])
+    out["bm25"] = bm[order]
+    out["score"] = score[order].astype(np.float32)
+    return out
+
+def _mask_key(allow: Optional[np.ndarray]) -> Optional[bytes]:
+    """Content digest of a row mask: equal masks built separately share a key."""
+    if allow is None:
+        return None
+    return hashlib.blake2b(np.packbits(allow).tobytes(), digest_size=16).digest()
+
+def _search_frames(bundle: IndexBundle, queries: List[str], Q: np.ndarray, topks: List[int],
+                   allows: Optional[List[Optional[np.ndarray]]] = None) -> List[pd.DataFrame]:
+    frames: List[Optional[pd.DataFrame]] = [None] * len(queries)
+    allows = allows or [None] * len(queries)
+    hybrid = bundle.retrieval == "hybrid"
+    # one FAISS call per distinct (topk, filter mask); masks are compared by
+    # content, since every request builds its own (same strong terms = same mask)
+    groups: Dict[Tuple[int, Optional[bytes]], List[int]] = {}
+    for i, (k, a) in enumerate(zip(topks, allows)):
+        groups.setdefault((k, _mask_key(a)), []).append(i)
+    for (k, _), rows in groups.items():
+        allow = allows[rows[0]]
+        with span("search"):
+            D, I = search_vectors(bundle, Q[rows], k, allow=allow)
+        with span("fuse" if hybrid else "frame"):
+            for j, i in enumerate(rows):
+                if hybrid:
+                    frames[i] = _fuse(bundle, queries[i], Q[i], I[j], k, allow=allow)
+                else:
+                    frames[i] = _results_frame(bundle, I[j], D[j])
+    return frames
+
+def filter_mask(bundle: IndexBundle, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """Row mask for structured filters (see filters.AttributeIndex.mask)."""
+    return bundle.attributes.mask(filters) if bundle.attributes is not None else None
+
+def search(bundle: IndexBundle, query: str, topk: int = 10,
+           filters: Optional[Dict[str, Any]] = None,
+           allow: Optional[np.ndarray] = None, use_cache: bool = True) -> pd.DataFrame:
+    """
+    Top-k catalog rows for `query`. `filters` (test_type / level / language /
+    min_duration / max_duration) and an optional row mask `allow` are applied
+    inside the index search rather than after it.
+    """
+    q = encode_queries(bundle, [query], use_cache=use_cache)
+    mask = combine_masks([allow, filter_mask(bundle, filters)])
+    return _search_frames(bundle, [query], q, [int(topk)], [mask])[0]
+
+def search_many(bundle: IndexBundle, queries: List[str], topk=10,
+                batch_size: int = 32, long_format: bool = False,
+                allow: Optional[List[Optional[np.ndarray]]] = None):
+    """
+    Batched version of `search`: one forward pass over all queries (chunked by
+    `batch_size` inside the encoder) and one FAISS search on the stacked matrix.
+    `topk` may be an int or a per-query list; queries sharing a topk and an
+    equal row mask share a FAISS call, so results match `search` exactly.
+    `allow` is an optional per-query list of row masks (see `search`).
+
+    Returns a list of per-query frames (same shape as `search`), or, with
+    long_format=True, a single frame with `query_idx`, `query` and `rank` columns.
+    """
+    queries = list(queries)
+    if not queries:
+        return pd.DataFrame() if long_format else []
+    topks = [int(topk)] * len(queries) if np.isscalar(topk) else [int(k) for k in topk]
+    if len(topks) != len(queries):
+        raise ValueError("topk list must have one entry per query")
+
+    Q = encode_queries(bundle, queries, batch_size=batch_size)
+    if allow is not None and len(allow) != len(queries):
+        raise ValueError("allow list must have one entry per query")
+    frames = _search_frames(bundle, queries, Q, topks, allow)
+    if not long_format:
+        return frames
+
+    for i, f in enumerate(frames):
+        f.insert(0, "rank", np.arange(1, len(f) + 1))
+        f.insert(0, "query", queries[i])
+        f.insert(0, "query_idx", i)
+    return pd.concat(frames, ignore_index=True)
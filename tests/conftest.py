@@ -0,0 +1,10 @@
+import os
+import sys
+
+# src/ modules import their siblings without the src. prefix (see indexer.py);
+# bench/ holds the stub encoder shared with the microbenchmarks
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for sub in ("src", "bench"):
+    path = os.path.join(ROOT, sub)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,38 @@
+import numpy as np
+
+from bm25 import BM25Builder, BM25Index
+
+DOCS_A = [
+    "Assessment Name: Java 8. Type: K. Description: core java, collections, streams.",
+    "Assessment Name: SQL Server. Type: K. Description: queries, joins, sql tuning.",
+    "",
+]
+DOCS_B = [
+    "Assessment Name: C++ and C#. Type: K. Description: c++ templates; c# linq.",
+    "Assessment Name: OPQ32. Type: P. Description: personality, teamwork, java java java.",
+]
+
+def assert_same_index(a: BM25Index, b: BM25Index) -> None:
+    assert a.vocab == b.vocab
+    assert a.n_docs == b.n_docs
+    np.testing.assert_array_equal(a.indptr, b.indptr)
+    np.testing.assert_array_equal(a.doc_ids, b.doc_ids)
+    np.testing.assert_array_equal(a.impacts, b.impacts)
+
+def test_builder_in_chunks_matches_build():
+    chunked = BM25Builder().add(DOCS_A).add(DOCS_B).finish()
+    assert_same_index(chunked, BM25Index.build(DOCS_A + DOCS_B))
+
+def test_builder_one_doc_per_chunk_and_params():
+    b = BM25Builder()
+    for d in DOCS_A + DOCS_B:
+        b.add([d])
+    assert_same_index(b.finish(k1=0.9, b=0.4), BM25Index.build(DOCS_A + DOCS_B, k1=0.9, b=0.4))
+
+def test_save_load_roundtrip(tmp_path):
+    idx = BM25Builder().add(DOCS_A).add(DOCS_B).finish()
+    idx.save(str(tmp_path / "bm25.npz"))
+    assert_same_index(BM25Index.load(str(tmp_path / "bm25.npz")), idx)
+    scores, ids = idx.search("java", topk=5)
+    assert list(ids) == [4, 0]   # higher term frequency first
+    assert (scores > 0).all()
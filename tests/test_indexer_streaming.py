@@ -0,0 +1,106 @@
+import json
+
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+import indexer
+from retriever import load_index, search
+from microbench import HashEncoder, synthetic_meta
+
+DIM = 32
+
+@pytest.fixture
+def stub_encoder(monkeypatch):
+    # small encode chunks so a few hundred rows span several reads
+    monkeypatch.setattr(indexer, "ENCODE_CHUNK", 64)
+    monkeypatch.setattr(indexer, "load_model", lambda *a, **k: HashEncoder(DIM))
+
+def make_catalog(n: int = 700) -> pd.DataFrame:
+    df = synthetic_meta(n, seed=1)
+    # integer durations with gaps only near the end: a chunk-wise read infers
+    # int64 for the early chunks and must still render "30.0" like a full read
+    df["duration_min"] = df["duration_min"].astype("Int64").astype(object)
+    df.loc[n - 5:, "duration_min"] = None
+    return df
+
+@pytest.fixture(params=["csv", "parquet"])
+def catalog(request, tmp_path):
+    df = make_catalog()
+    if request.param == "csv":
+        path = tmp_path / "catalog.csv"
+        df.to_csv(path, index=False)
+    else:
+        path = tmp_path / "catalog.parquet"
+        df["duration_min"] = pd.to_numeric(df["duration_min"]).astype("Int64")
+        df.to_parquet(path, index=False, row_group_size=100)   # batches stop at row groups
+    return str(path)
+
+def test_iter_catalog_yields_exact_chunks(catalog):
+    sizes = [len(df) for df in indexer.iter_catalog(catalog, 128)]
+    assert sizes == [128] * 5 + [60]
+
+def test_rechunk_rebuffers_short_batches():
+    frames, start = [], 0
+    for k in (100, 28, 3, 200, 1, 50):   # e.g. Parquet batches cut at row-group ends
+        frames.append(pd.DataFrame({"row": range(start, start + k)}, index=range(7, 7 + k)))
+        start += k
+    out = list(indexer._rechunk(frames, 128))
+    assert [len(f) for f in out] == [128, 128, 126]
+    assert pd.concat(out)["row"].tolist() == list(range(start))
+    assert all(f.index.tolist() == list(range(len(f))) for f in out)
+
+def build(catalog, out, stream):
+    out.mkdir()
+    # nlist=20: 39 * 20 >= 700 rows, so the streamed training sample is every vector
+    indexer.build(catalog, out, "stub-model", index_type="ivfpq", index_overrides={"nlist": 20},
+                  stream=stream, read_chunk=128)
+    return out
+
+def test_streamed_build_matches_in_memory(stub_encoder, catalog, tmp_path):
+    mem = build(catalog, tmp_path / "mem", stream=False)
+    st = build(catalog, tmp_path / "stream", stream=True)
+
+    np.testing.assert_array_equal(np.load(st / "vectors.npy"), np.load(mem / "vectors.npy"))
+    assert json.loads((st / indexer.PARAMS_FILE).read_text()) == json.loads((mem / indexer.PARAMS_FILE).read_text())
+    for name in (indexer.BM25_FILE, indexer.KEYWORDS_FILE, indexer.ATTRIBUTES_FILE):
+        with np.load(st / name) as a, np.load(mem / name) as b:
+            assert sorted(a.files) == sorted(b.files), name
+            for key in a.files:
+                np.testing.assert_array_equal(a[key], b[key], err_msg=f"{name}:{key}")
+
+    # same training set, so the IVF-PQ indexes are the same
+    X = np.load(mem / "vectors.npy")[:20]
+    D1, I1 = faiss.read_index(str(st / "faiss.index")).search(X, 10)
+    D2, I2 = faiss.read_index(str(mem / "faiss.index")).search(X, 10)
+    np.testing.assert_array_equal(I1, I2)
+    np.testing.assert_array_equal(D1, D2)
+
+    m_st, m_mem = pd.read_parquet(st / "meta.parquet"), pd.read_parquet(mem / "meta.parquet")
+    assert len(m_st) == len(m_mem)
+    np.testing.assert_array_equal(pd.to_numeric(m_st["duration_min"]).to_numpy(dtype=float),
+                                  pd.to_numeric(m_mem["duration_min"]).to_numpy(dtype=float))
+    assert m_st["title"].tolist() == m_mem["title"].astype(str).tolist()
+    assert json.loads((st / "manifest.json").read_text())["rows"] == len(m_mem)
+
+    # the streamed dir passes manifest validation and serves queries
+    bundle = load_index(str(st), model=HashEncoder(DIM), mmap=True)
+    assert bundle.index_params["type"] == "ivfpq"
+    assert len(search(bundle, "python developer", topk=5)) == 5
+
+def test_stream_refuses_flat(stub_encoder, catalog, tmp_path):
+    with pytest.raises(SystemExit, match="ivfpq"):
+        indexer.build(catalog, tmp_path, "stub-model", index_type="flat", stream=True)
+
+def test_default_nlist_leaves_enough_training_points():
+    for n in (500, 5_000, 50_000, 1_000_000):
+        params = indexer.default_index_params("ivfpq", n, 384)
+        assert n >= indexer.TRAIN_PER_CENTROID * params["nlist"]
+        assert n >= indexer.TRAIN_PER_CENTROID * (1 << params["pq_nbits"]) or params["pq_nbits"] == 4
+
+def test_train_sample_is_spread_over_the_catalog():
+    vectors = np.arange(10_000, dtype=np.float32).reshape(-1, 1)
+    sample = indexer.train_sample(vectors, {"type": "ivfflat", "nlist": 10})
+    assert len(sample) == 390
+    assert sample[:, 0].max() > 9000 and np.all(np.diff(sample[:, 0]) > 0)